@@ -0,0 +1,256 @@
+import os
+import asyncio
+import hashlib
+import tempfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from download_warranty_pdf import get_download_settings, get_pdf_filename
+from pdf_store import store_pdf
+from metrics import instrument, count, record_bytes, record_retry
+from http_session import RETRY_STATUSES, get_session_settings
+from url_cache import get_url_cache, conditional_headers
+from pipeline import make_report
+from concurrent_processing import (
+    StageError,
+    find_resumable_pdf,
+    record_download,
+    resolve_stage,
+    download_stage,
+    upload_stage
+)
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+def get_async_settings():
+    """Read concurrency limits and timeouts for the asyncio runner."""
+    return {
+        'gmail_concurrency': int(os.getenv('ASYNC_GMAIL_CONCURRENCY', '4')),
+        'cdn_concurrency': int(os.getenv('ASYNC_CDN_CONCURRENCY', '64')),
+        'drive_concurrency': int(os.getenv('ASYNC_DRIVE_CONCURRENCY', '8')),
+        'offload_threads': int(os.getenv('ASYNC_OFFLOAD_THREADS', '16')),
+        'max_in_flight': int(os.getenv('ASYNC_MAX_IN_FLIGHT', '1000')),
+        'message_timeout': float(os.getenv('ASYNC_MESSAGE_TIMEOUT', '600'))
+    }
+
+async def _stream_pdf_async(session, url, sink, settings, headers=None):
+    """Stream a PDF into sink with aiohttp, hashing as it arrives.
+
+    Returns (filename, sha256, size, validators) like _stream_pdf, or None
+    when a conditional request was answered with 304 Not Modified.
+    """
+    async with session.get(url, allow_redirects=True, headers=headers) as response:
+        if response.status == 304:
+            return None
+        response.raise_for_status()
+
+        # Reject oversized files before reading the body
+        if response.content_length and response.content_length > settings['max_bytes']:
+            raise ValueError(f"PDF is {response.content_length} bytes, limit is {settings['max_bytes']}")
+
+        filename = get_pdf_filename(response, url)
+        validators = {
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified')
+        }
+        sha256 = hashlib.sha256()
+        size = 0
+        async for chunk in response.content.iter_chunked(settings['chunk_size']):
+            size += len(chunk)
+            if size > settings['max_bytes']:
+                raise ValueError(f"PDF exceeds size limit of {settings['max_bytes']} bytes")
+            sha256.update(chunk)
+            sink.write(chunk)
+    return filename, sha256.hexdigest(), size, validators
+
+def _is_retryable(error):
+    """Whether a failed aiohttp download is worth retrying, as the requests session would."""
+    if isinstance(error, aiohttp.ClientResponseError):
+        return error.status in RETRY_STATUSES
+    return isinstance(error, (aiohttp.ClientConnectionError, asyncio.TimeoutError))
+
+@instrument('download_pdf')
+async def download_pdf_async(session, url, output_dir="downloaded_pdfs"):
+    """Download a PDF with aiohttp into the content-addressed store.
+
+    Mirrors download_pdf: the body is streamed and hashed into a temp file
+    that is moved into the store once complete, a URL downloaded before is
+    revalidated with a conditional GET, and connection errors and
+    RETRY_STATUSES are retried HTTP_RETRIES times with the same backoff.
+    """
+    settings = get_download_settings()
+    retry_settings = get_session_settings()
+    url_cache = get_url_cache()
+    cached = url_cache.get(url) if url_cache else None
+    headers = conditional_headers(cached) if cached else None
+    temp_path = None
+    try:
+        os.makedirs(output_dir, exist_ok=True)
+        attempt = 0
+        while True:
+            fd, temp_path = tempfile.mkstemp(dir=output_dir, suffix='.part')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    result = await _stream_pdf_async(session, url, f, settings, headers)
+                break
+            except Exception as e:
+                if attempt >= retry_settings['retries'] or not _is_retryable(e):
+                    raise
+            os.remove(temp_path)
+            temp_path = None
+            attempt += 1
+            # urllib3's schedule: retry at once, then back off exponentially
+            if attempt > 1:
+                await asyncio.sleep(retry_settings['backoff_factor'] * 2 ** (attempt - 1))
+        if attempt:
+            record_retry('download_pdf', attempt)
+
+        if result is None:
+            url_cache.revalidated(url)
+            count('url_cache', outcome='not_modified')
+            print(f"PDF not modified, using local copy: {cached['local_path']}")
+            return cached['local_path']
+
+        filename, digest, size, validators = result
+        record_bytes('download', size)
+        output_path = store_pdf(temp_path, output_dir, digest, filename)
+        temp_path = None
+        if url_cache and (validators['etag'] or validators['last_modified']):
+            url_cache.record(url, output_path, digest, size, **validators)
+        count('url_cache', outcome='revalidated_changed' if cached else 'miss')
+        print(f"PDF downloaded successfully to: {output_path}")
+        return output_path
+    except Exception as e:
+        print(f"Error downloading PDF: {e}")
+        return None
+    finally:
+        if temp_path and os.path.exists(temp_path):
+            os.remove(temp_path)
+
+class AsyncRunner:
+    """Process warranty emails on one event loop.
+
+    The CDN download uses aiohttp when it is installed. Google API calls have
+    no async client, so they are offloaded to a small shared thread pool.
+    Each service has its own semaphore, so thousands of messages can wait on
+    I/O at once without a thread per message. Every message runs under one
+    timeout, and cancelling the run cancels all of its messages.
+    """
+
+    def __init__(self, fetch_batch, parse, ledger=None, batch_size=100, settings=None):
+        self.fetch_batch = fetch_batch
+        self.parse = parse
+        self.ledger = ledger
+        self.batch_size = batch_size
+        self.settings = settings or get_async_settings()
+
+    def run(self, message_ids, on_result):
+        """Process the listed message IDs and return their reports in order."""
+        return asyncio.run(self._run(message_ids, on_result))
+
+    async def _run(self, message_ids, on_result):
+        settings = self.settings
+        loop = asyncio.get_running_loop()
+        executor = ThreadPoolExecutor(max_workers=settings['offload_threads'], thread_name_prefix='async-offload')
+        loop.set_default_executor(executor)
+
+        self.gmail_limit = asyncio.Semaphore(settings['gmail_concurrency'])
+        self.cdn_limit = asyncio.Semaphore(settings['cdn_concurrency'])
+        self.drive_limit = asyncio.Semaphore(settings['drive_concurrency'])
+        self.session = None
+        if aiohttp is None:
+            print("WARNING: aiohttp is not installed, so PROCESSING_MODE=async downloads PDFs on "
+                  f"{settings['offload_threads']} worker threads instead; run pip install -r requirements.txt")
+        elif os.getenv('PDF_STORAGE', 'disk') != 'memory':
+            connect_timeout, read_timeout = get_download_settings()['timeout']
+            self.session = aiohttp.ClientSession(
+                timeout=aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout),
+                connector=aiohttp.TCPConnector(limit=settings['cdn_concurrency'])
+            )
+
+        reports = []
+        in_flight = deque()
+
+        async def drain_head():
+            message_id, task = in_flight.popleft()
+            try:
+                outcome = await task
+            except asyncio.TimeoutError:
+                outcome = StageError('timeout', f"Email {message_id} took longer than {settings['message_timeout']}s")
+            except Exception as e:
+                outcome = e
+            report = make_report(message_id, outcome)
+            reports.append(report)
+            # The sheet writer is blocking, but only ever called from here
+            await asyncio.to_thread(on_result, report)
+
+        iterator = iter(message_ids)
+        try:
+            while True:
+                # Listing pages block on the Gmail client, so read them off-loop
+                batch_ids = await asyncio.to_thread(lambda: list(islice(iterator, self.batch_size)))
+                if not batch_ids:
+                    break
+                if self.ledger:
+                    batch_ids = await asyncio.to_thread(self.ledger.filter_unprocessed, batch_ids)
+                if not batch_ids:
+                    continue
+
+                fetched = asyncio.ensure_future(self._fetch(batch_ids))
+                for message_id in batch_ids:
+                    while len(in_flight) >= settings['max_in_flight']:
+                        await drain_head()
+                    in_flight.append((message_id, asyncio.ensure_future(asyncio.wait_for(
+                        self._process(message_id, fetched),
+                        timeout=settings['message_timeout']
+                    ))))
+
+            while in_flight:
+                await drain_head()
+        finally:
+            # Cancel whatever is still running if the run itself was cancelled
+            for _, task in in_flight:
+                task.cancel()
+            await asyncio.gather(*(task for _, task in in_flight), return_exceptions=True)
+            if self.session is not None:
+                await self.session.close()
+            executor.shutdown(wait=False)
+
+        return reports
+
+    async def _fetch(self, batch_ids):
+        """Fetch one batch of messages through the Gmail batch endpoint."""
+        async with self.gmail_limit:
+            return await asyncio.to_thread(self.fetch_batch, batch_ids)
+
+    async def _process(self, message_id, fetched):
+        """Run one message through fetch, parse, download and upload."""
+        messages = await asyncio.shield(fetched)
+        if message_id not in messages:
+            raise StageError('fetch', f"Could not fetch email {message_id}")
+
+        parsed = await asyncio.to_thread(self.parse, message_id, messages[message_id])
+        local_pdf = await self._download(message_id, parsed)
+
+        async with self.drive_limit:
+            return await asyncio.to_thread(upload_stage, message_id, parsed, local_pdf, self.ledger)
+
+    async def _download(self, message_id, parsed):
+        """Download the PDF with aiohttp, or on a thread without it."""
+        async with self.cdn_limit:
+            if self.session is None:
+                return await asyncio.to_thread(download_stage, message_id, parsed, self.ledger)
+
+            found, local_pdf = find_resumable_pdf(message_id, self.ledger)
+            if found:
+                return local_pdf
+
+            local_pdf = await download_pdf_async(self.session, resolve_stage(message_id, parsed))
+            if not local_pdf:
+                raise StageError('download', f"Could not download PDF for email {message_id}")
+
+            record_download(message_id, local_pdf, self.ledger)
+            return local_pdf
@@ -0,0 +1,178 @@
+import os
+import json
+import time
+import threading
+from datetime import date, datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from google_services import get_service
+from index import get_warranty_emails, process_message_ids, print_pool_stats
+from ledger import get_ledger
+from metrics import write_metrics_report
+
+def get_backfill_settings():
+    """Read the backfill window size, worker count and checkpoint path from the environment."""
+    return {
+        'window_days': int(os.getenv('BACKFILL_WINDOW_DAYS', '7')),
+        'workers': int(os.getenv('BACKFILL_WORKERS', '4')),
+        'checkpoint_path': os.getenv('BACKFILL_CHECKPOINT_PATH', 'backfill_checkpoint.json')
+    }
+
+def parse_date(value):
+    """Parse a YYYY/MM/DD or YYYY-MM-DD date."""
+    return datetime.strptime(value.replace('-', '/'), '%Y/%m/%d').date()
+
+def split_windows(start, end, window_days):
+    """Split [start, end) into consecutive windows of at most window_days days."""
+    windows = []
+    while start < end:
+        window_end = min(start + timedelta(days=window_days), end)
+        windows.append((start, window_end))
+        start = window_end
+    return windows
+
+def window_key(window):
+    """Name a window in the checkpoint file, e.g. 2024/01/01-2024/01/08."""
+    start, end = window
+    return f"{start:%Y/%m/%d}-{end:%Y/%m/%d}"
+
+def window_query(window):
+    """Build the Gmail search clause for a window.
+
+    Epoch seconds at local midnight are used rather than dates, which Gmail
+    would read in its own time zone. A message on a boundary second can be
+    listed by both neighbours; the ledger skips the second one.
+    """
+    start, end = window
+    after = int(time.mktime(start.timetuple()))
+    before = int(time.mktime(end.timetuple()))
+    return f"after:{after} before:{before}"
+
+class BackfillCheckpoint:
+    """Completed backfill windows, persisted after each one finishes.
+
+    The file belongs to one date range and window size; a backfill over a
+    different range starts a new checkpoint.
+    """
+
+    def __init__(self, path, start, end, window_days):
+        self.path = path
+        self.scope = {
+            'start': f"{start:%Y/%m/%d}",
+            'end': f"{end:%Y/%m/%d}",
+            'window_days': window_days
+        }
+        self.completed = {}
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+
+        try:
+            with open(self.path, 'r') as f:
+                checkpoint = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable backfill checkpoint {self.path}: {e}")
+            return
+
+        if checkpoint.get('scope') != self.scope:
+            print(f"Backfill checkpoint {self.path} is for another range, starting over")
+            return
+        self.completed = checkpoint.get('completed', {})
+
+    def is_done(self, window):
+        with self._lock:
+            return window_key(window) in self.completed
+
+    def mark_done(self, window, messages):
+        """Record a finished window and write the checkpoint atomically."""
+        with self._lock:
+            self.completed[window_key(window)] = {
+                'messages': messages,
+                'finished_at': int(time.time())
+            }
+            checkpoint = {'scope': self.scope, 'completed': self.completed}
+
+            temp_path = f"{self.path}.tmp"
+            with open(temp_path, 'w') as f:
+                json.dump(checkpoint, f, indent=2, sort_keys=True)
+            os.replace(temp_path, self.path)
+
+def backfill_window(window, ledger):
+    """List and process one window; return (listed, still unfinished) counts.
+
+    Emails that failed permanently, with no HTML or no PDF link, count as
+    finished so they cannot hold their window back forever. Runs on a
+    worker thread, which builds its own Gmail and Sheets clients.
+    """
+    gmail_service = get_service('gmail')
+    message_ids = list(get_warranty_emails(gmail_service, window=window_query(window), raise_errors=True))
+    if message_ids:
+        process_message_ids(gmail_service, get_service('sheets'), message_ids, ledger)
+    return len(message_ids), len(ledger.filter_unfinished(message_ids))
+
+def run_backfill(start, end, window_days=None, workers=None, checkpoint_path=None, restart=False):
+    """Process every warranty email in [start, end) in parallel date windows.
+
+    Each worker thread takes one window at a time. A window is recorded in
+    the checkpoint file once all of its messages are in the sheet or have
+    failed permanently, so an interrupted backfill resumes with the windows
+    still missing; a window whose listing failed or that has retryable
+    failures is retried on the next run. All workers share the
+    process-wide rate limiters, so adding workers raises throughput until
+    the Gmail, Drive or Sheets quota is reached. The sync checkpoint is not
+    touched. Returns how many messages were listed.
+    """
+    settings = get_backfill_settings()
+    window_days = window_days or settings['window_days']
+    workers = workers or settings['workers']
+    checkpoint_path = checkpoint_path or settings['checkpoint_path']
+
+    if restart and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    checkpoint = BackfillCheckpoint(checkpoint_path, start, end, window_days)
+
+    windows = split_windows(start, end, window_days)
+    pending = [window for window in windows if not checkpoint.is_done(window)]
+    print(f"Backfilling {start:%Y/%m/%d} to {end:%Y/%m/%d}: {len(windows)} windows of {window_days} days, "
+          f"{len(windows) - len(pending)} already done, {workers} workers")
+
+    ledger = get_ledger()
+    listed = 0
+    incomplete = 0
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='backfill') as executor:
+        futures = {executor.submit(backfill_window, window, ledger): window for window in pending}
+        for future in as_completed(futures):
+            window = futures[future]
+            try:
+                messages, unprocessed = future.result()
+            except Exception as e:
+                print(f"Error backfilling {window_key(window)}: {e}")
+                incomplete += 1
+                continue
+
+            listed += messages
+            if unprocessed:
+                print(f"Window {window_key(window)}: {unprocessed} of {messages} emails not processed, will retry")
+                incomplete += 1
+                continue
+
+            checkpoint.mark_done(window, messages)
+            print(f"Window {window_key(window)}: {messages} emails")
+
+    elapsed = time.perf_counter() - started
+    rate = listed / elapsed if elapsed else 0.0
+    print(f"Backfill listed {listed} emails in {elapsed:.1f}s ({rate:.1f} emails/s), "
+          f"{len(pending) - incomplete}/{len(pending)} windows completed")
+    if incomplete:
+        print(f"{incomplete} windows incomplete; run the backfill again to retry them")
+    print_pool_stats()
+    write_metrics_report()
+    return listed
+
+def default_range(days):
+    """Return the [start, end) range covering the last days days, including today."""
+    end = date.today() + timedelta(days=1)
+    return end - timedelta(days=days), end
@@ -0,0 +1,360 @@
+import argparse
+import base64
+import contextlib
+import io
+import os
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import quote
+from bs4 import BeautifulSoup
+from html_extract import ParsedEmail, find_pdf_href_soup, lxml
+
+PROCESSING_MODES = ('sequential', 'concurrent', 'pipeline', 'async')
+
+def make_globo_url(pdf_url):
+    """Wrap a CDN URL the way globo tracking links do."""
+    ext = base64.b64encode(f"link={quote(pdf_url, safe=':/')}".encode('utf-8')).decode('ascii')
+    return f"https://email.globosoftware.net/WGMRVTBFZCKE?id=63059&fl=WhEVFUsMGRxQSBYWRlZGBkUHR15fVkFe&ext={ext}"
+
+def make_warranty_html(index=0, filler_rows=40, pdf_base_url=None):
+    """Build a warranty submission email similar in shape to the real ones.
+    
+    pdf_base_url replaces the CDN host, e.g. to point at a local PDF server.
+    """
+    base_url = pdf_base_url or "https://globo.sfo2.cdn.digitaloceanspaces.com"
+    pdf_url = f"{base_url}/files/ajensenflyfishing.myshopify.com/invoice{index}.pdf"
+    rows = ''.join(
+        f'<tr><td style="padding:4px;font-family:Arial">Field {i}</td>'
+        f'<td style="padding:4px;font-family:Arial">Value {i} for submission {index}</td></tr>'
+        for i in range(filler_rows)
+    )
+    return f'''
+    <html><head><style>td {{ color: #333; }}</style></head><body>
+    <table width="100%" cellpadding="0" cellspacing="0">
+      <tr><td><h2>New Warranty Form Submission</h2></td></tr>
+      <tr><td><a href="https://ajensenfishing.dk">Visit store</a></td></tr>
+      <tr><td><table>
+        <tr><td>Name:</td><td>Customer {index}</td></tr>
+        <tr><td>Email:</td><td>customer{index}@example.com</td></tr>
+        <tr><td>Phone:</td><td>+45 12 34 56 {index % 100:02d}</td></tr>
+        <tr><td>Address:</td><td>Fiskervej {index}, 7100 Vejle</td></tr>
+        <tr><td>Product:</td><td>Nordic Flies Rod 9ft #5</td></tr>
+        <tr><td>Serial number:</td><td>NF-{index:06d}</td></tr>
+        <tr><td>Purchase date:</td><td>21.04.2025</td></tr>
+        <tr><td>Invoice:</td><td><a href="{make_globo_url(pdf_url)}" target="_blank">Rechnung {index}.pdf</a></td></tr>
+        {rows}
+      </table></td></tr>
+    </table>
+    </body></html>
+    '''
+
+def time_per_email(func, emails, repeat):
+    """Return the mean seconds per email for func over repeat passes."""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for html_content in emails:
+            func(html_content)
+    return (time.perf_counter() - start) / (repeat * len(emails))
+
+def bench_html_extraction(count=200, repeat=3):
+    """Compare per-email parse time of the BeautifulSoup and fast-path extractors.
+
+    The baseline is the old behaviour: one html.parser pass to find the PDF
+    link and a second one for the customer details.
+    """
+    emails = [make_warranty_html(i) for i in range(count)]
+
+    def two_soup_passes(html_content):
+        find_pdf_href_soup(BeautifulSoup(html_content, 'html.parser'))
+        BeautifulSoup(html_content, 'html.parser')
+
+    def shared_soup(html_content):
+        parsed = ParsedEmail(html_content, extractor='soup')
+        parsed.pdf_href
+        parsed.soup
+
+    results = {
+        'soup x2 (old)': time_per_email(two_soup_passes, emails, repeat),
+        'soup shared': time_per_email(shared_soup, emails, repeat),
+        'stream': time_per_email(lambda h: ParsedEmail(h, extractor='stream').pdf_href, emails, repeat)
+    }
+    if lxml is not None:
+        results['lxml'] = time_per_email(lambda h: ParsedEmail(h, extractor='lxml').pdf_href, emails, repeat)
+
+    # Every extractor must agree with the BeautifulSoup result
+    for html_content in emails[:10]:
+        expected = find_pdf_href_soup(BeautifulSoup(html_content, 'html.parser'))
+        assert ParsedEmail(html_content, extractor='stream').pdf_href == expected
+
+    baseline = results['soup x2 (old)']
+    print(f"HTML extraction over {count} emails x {repeat}:")
+    for name, seconds in results.items():
+        print(f"  {name:<14} {seconds * 1e6:9.1f} us/email  {baseline / seconds:5.1f}x")
+    return results
+
+def make_mailbox(count, pdf_base_url, filler_rows=40):
+    """Build a synthetic mailbox of message ID to warranty email HTML."""
+    return {
+        f"msg{index:06d}": make_warranty_html(index, filler_rows, pdf_base_url)
+        for index in range(count)
+    }
+
+class _PdfHandler(BaseHTTPRequestHandler):
+    """Serve a distinct PDF of the configured size for every path.
+
+    Each PDF carries an ETag, and a matching If-None-Match gets a 304 like
+    the real CDN.
+    """
+
+    def do_GET(self):
+        server = self.server
+        if server.latency:
+            time.sleep(server.latency)
+        etag = f'"{server.pdf_size}-{abs(hash(self.path))}"'
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+        header = f"%PDF-1.4\n% {self.path}\n".encode('utf-8')
+        body = header + b'0' * max(0, server.pdf_size - len(header))
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/pdf')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class _PdfHttpServer(ThreadingHTTPServer):
+    # The default backlog of 5 stalls bursts of concurrent downloads
+    request_queue_size = 128
+    daemon_threads = True
+
+class PdfServer:
+    """Local HTTP server standing in for the globo CDN."""
+
+    def __init__(self, pdf_size=200 * 1024, latency=0.0):
+        self.server = _PdfHttpServer(('127.0.0.1', 0), _PdfHandler)
+        self.server.pdf_size = pdf_size
+        self.server.latency = latency
+        self.base_url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self._thread = threading.Thread(target=self.server.serve_forever, name='pdf-server', daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.server.shutdown()
+        self.server.server_close()
+
+class StageTimer:
+    """Thread-safe collection of latency samples per stage."""
+
+    def __init__(self):
+        self.samples = {}
+        self._lock = threading.Lock()
+
+    def record(self, stage, seconds):
+        with self._lock:
+            self.samples.setdefault(stage, []).append(seconds)
+
+    def wrap(self, stage, func):
+        """Return func timed under stage."""
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.record(stage, time.perf_counter() - start)
+        return timed
+
+    def percentiles(self, points=(50, 90, 99)):
+        """Return {stage: {count, p50, p90, p99, max}} using nearest rank."""
+        summary = {}
+        with self._lock:
+            samples = {stage: sorted(values) for stage, values in self.samples.items()}
+        for stage, values in samples.items():
+            summary[stage] = {'count': len(values), 'max': values[-1]}
+            for point in points:
+                rank = max(0, -(-point * len(values) // 100) - 1)
+                summary[stage][f"p{point}"] = values[rank]
+        return summary
+
+@contextlib.contextmanager
+def patched(*replacements):
+    """Temporarily replace (module, attribute, value) triples."""
+    originals = [(module, name, getattr(module, name)) for module, name, _ in replacements]
+    try:
+        for module, name, value in replacements:
+            setattr(module, name, value)
+        yield
+    finally:
+        for module, name, value in originals:
+            setattr(module, name, value)
+
+def bench_end_to_end(mode, mailbox, api_latency=0.0, error_rate=0.0, seed=1):
+    """Run one sync over the fake services in a PROCESSING_MODE and time it.
+    
+    Returns throughput, per-stage latency percentiles and fake API counters.
+    Each run gets a fresh ledger, upload index and PDF store in a temp dir.
+    """
+    import index
+    import concurrent_processing
+    import download_warranty_pdf
+    import pdf_store
+    import url_cache
+    from fake_google import FakeGmail, FakeDrive, FakeSheets, FaultInjector
+    from ledger import Ledger
+    
+    timer = StageTimer()
+    def faults(offset):
+        return FaultInjector(latency=api_latency, jitter=api_latency / 2, error_rate=error_rate,
+                             seed=seed + offset, on_call=timer.record)
+    services = {
+        'gmail': FakeGmail(mailbox, faults(0)),
+        'drive': FakeDrive(faults(1)),
+        'sheets': FakeSheets(faults(2))
+    }
+    get_service = services.__getitem__
+    
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as work_dir:
+        os.chdir(work_dir)
+        ledger = Ledger(os.path.join(work_dir, 'ledger.db'))
+        upload_index = pdf_store.UploadIndex(os.path.join(work_dir, 'pdf_index.db'))
+        pdf_urls = url_cache.UrlCache(os.path.join(work_dir, 'url_cache.db'))
+        os.environ['PROCESSING_MODE'] = mode
+        try:
+            with patched(
+                (index, 'get_service', get_service),
+                (download_warranty_pdf, 'get_service', get_service),
+                (pdf_store, '_upload_index', upload_index),
+                (url_cache, '_url_cache', pdf_urls),
+                (index, 'fetch_messages', timer.wrap('fetch', index.fetch_messages)),
+                (concurrent_processing, 'resolve_pdf_url', timer.wrap('resolve', concurrent_processing.resolve_pdf_url)),
+                (concurrent_processing, 'fetch_pdf', timer.wrap('download', concurrent_processing.fetch_pdf)),
+                (concurrent_processing, 'upload_to_drive', timer.wrap('upload', concurrent_processing.upload_to_drive))
+            ), contextlib.redirect_stdout(io.StringIO()):
+                start = time.perf_counter()
+                count = index.sync_once(services['gmail'], services['sheets'], ledger, window='newer_than:1d')
+                elapsed = time.perf_counter() - start
+        finally:
+            ledger.close()
+            upload_index.close()
+            pdf_urls.close()
+            os.chdir(cwd)
+    
+    return {
+        'mode': mode,
+        'messages': count,
+        'rows': len(services['sheets'].rows),
+        'seconds': elapsed,
+        'messages_per_second': len(services['sheets'].rows) / elapsed if elapsed else 0.0,
+        'stages': timer.percentiles(),
+        'api_calls': {api: service.faults.calls for api, service in services.items()},
+        'injected_errors': {api: service.faults.errors for api, service in services.items()}
+    }
+
+def bench_pipeline(count=200, modes=PROCESSING_MODES, pdf_size=200 * 1024, api_latency=0.02,
+                   cdn_latency=0.02, error_rate=0.0):
+    """Compare processing modes end to end against fake services and a local CDN."""
+    # Quota pacing would measure the rate limiter, not the processor
+    for api in ('GMAIL', 'DRIVE', 'SHEETS'):
+        os.environ.setdefault(f"RATE_LIMIT_{api}", '1000000')
+    os.environ.setdefault('RATE_LIMIT_BACKOFF_BASE', '0.01')
+    
+    results = []
+    with PdfServer(pdf_size, cdn_latency) as server:
+        mailbox = make_mailbox(count, server.base_url)
+        print(f"End to end over {count} emails, {pdf_size // 1024} KiB PDFs, "
+              f"{api_latency * 1000:.0f} ms API / {cdn_latency * 1000:.0f} ms CDN latency, "
+              f"{error_rate:.0%} injected errors:")
+        for mode in modes:
+            result = bench_end_to_end(mode, mailbox, api_latency, error_rate)
+            results.append(result)
+            print(f"  {mode:<11} {result['rows']:5d}/{count} rows in {result['seconds']:6.2f}s  "
+                  f"{result['messages_per_second']:7.1f} msgs/s")
+            for stage, stats in sorted(result['stages'].items()):
+                print(f"      {stage:<16} n={stats['count']:<5d} p50 {stats['p50'] * 1000:7.1f} ms  "
+                      f"p90 {stats['p90'] * 1000:7.1f} ms  p99 {stats['p99'] * 1000:7.1f} ms  "
+                      f"max {stats['max'] * 1000:7.1f} ms")
+    return results
+
+def bench_parse_pool(count=2000, process_counts=None, chunk_size=16):
+    """Compare parse throughput in-process and on 1..N worker processes.
+
+    Parses raw Gmail messages the way the parse stage does, MIME decoding
+    included, and checks every pool result against the in-process parse.
+    """
+    from fake_google import make_raw_message
+    from index import parse_message
+    from parse_pool import ParsePool
+    
+    messages = [(f"msg{index:06d}", {'raw': make_raw_message(f"msg{index:06d}", make_warranty_html(index))})
+                for index in range(count)]
+    process_counts = process_counts or sorted({1, 2, os.cpu_count() or 1})
+    
+    start = time.perf_counter()
+    expected = [parse_message(message_id, message) for message_id, message in messages]
+    baseline = count / (time.perf_counter() - start)
+    print(f"Parsing {count} raw emails ({os.cpu_count()} CPUs), chunks of {chunk_size}:")
+    print(f"  {'in-process':<12} {baseline:8.0f} emails/s")
+    
+    results = {'in-process': baseline}
+    for processes in process_counts:
+        pool = ParsePool(processes, chunk_size)
+        try:
+            # Start the workers before timing
+            list(pool.iter_extracted(messages[:processes * chunk_size]))
+            start = time.perf_counter()
+            extracted = list(pool.iter_extracted(messages))
+            rate = count / (time.perf_counter() - start)
+        finally:
+            pool.close()
+        for (_, result), parsed in zip(extracted, expected):
+            assert result.pdf_href == parsed.pdf_href and result.form_fields == parsed.form_fields
+        results[processes] = rate
+        print(f"  {processes:>2} processes  {rate:8.0f} emails/s  {rate / baseline:5.2f}x")
+    return results
+
+def main():
+    """Run the benchmarks selected on the command line."""
+    parser = argparse.ArgumentParser(description='Warranty processor benchmarks')
+    parser.add_argument('--suite', choices=('html', 'pipeline', 'parse', 'all'), default='html')
+    parser.add_argument('--emails', type=int, default=200)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--modes', default=','.join(PROCESSING_MODES),
+                        help='comma-separated PROCESSING_MODE values to compare')
+    parser.add_argument('--pdf-kib', type=int, default=200, help='size of each served PDF')
+    parser.add_argument('--api-latency-ms', type=float, default=20)
+    parser.add_argument('--cdn-latency-ms', type=float, default=20)
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='fraction of fake API calls that fail with a 429')
+    parser.add_argument('--processes', help='comma-separated parse process counts to compare')
+    args = parser.parse_args()
+
+    if args.suite in ('html', 'all'):
+        bench_html_extraction(args.emails, args.repeat)
+    if args.suite in ('pipeline', 'all'):
+        bench_pipeline(
+            args.emails,
+            [mode.strip() for mode in args.modes.split(',') if mode.strip()],
+            args.pdf_kib * 1024,
+            args.api_latency_ms / 1000,
+            args.cdn_latency_ms / 1000,
+            args.error_rate
+        )
+    if args.suite in ('parse', 'all'):
+        bench_parse_pool(
+            args.emails * 10,
+            [int(processes) for processes in args.processes.split(',')] if args.processes else None
+        )
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,220 @@
+import argparse
+import os
+import sys
+import threading
+import time
+
+# Only the standard library is imported up front; each command imports the
+# modules it needs, so `stats` never loads the Google client and `sync`
+# only loads the processors when there is new mail.
+
+class _TimedLoader:
+    """Wraps a module loader to time the module's execution."""
+
+    def __init__(self, loader, profiler):
+        self.loader = loader
+        self.profiler = profiler
+
+    def create_module(self, spec):
+        return self.loader.create_module(spec)
+
+    def exec_module(self, module):
+        self.profiler.enter()
+        start = time.perf_counter()
+        try:
+            self.loader.exec_module(module)
+        finally:
+            self.profiler.leave(module.__name__, time.perf_counter() - start)
+            # Hand the real loader back once the module is loaded
+            module.__loader__ = self.loader
+            if getattr(module, '__spec__', None) is not None:
+                module.__spec__.loader = self.loader
+
+    def __getattr__(self, name):
+        return getattr(self.loader, name)
+
+class ImportProfiler:
+    """Meta path finder that records how long each imported module takes.
+
+    Cumulative time includes the imports a module triggers; self time
+    excludes them, so the two together show where startup goes.
+    """
+
+    def __init__(self):
+        self.timings = {}
+        self.total = 0.0
+        self._local = threading.local()
+
+    def install(self):
+        sys.meta_path.insert(0, self)
+
+    def uninstall(self):
+        if self in sys.meta_path:
+            sys.meta_path.remove(self)
+
+    def find_spec(self, name, path, target=None):
+        if getattr(self._local, 'finding', False):
+            return None
+
+        # Let the remaining finders locate the module, then time its loader
+        self._local.finding = True
+        try:
+            for finder in sys.meta_path:
+                if finder is self or not hasattr(finder, 'find_spec'):
+                    continue
+                spec = finder.find_spec(name, path, target)
+                if spec is not None:
+                    break
+            else:
+                return None
+        finally:
+            self._local.finding = False
+
+        if spec.loader is not None and hasattr(spec.loader, 'exec_module'):
+            spec.loader = _TimedLoader(spec.loader, self)
+        return spec
+
+    def enter(self):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        stack.append(0.0)
+
+    def leave(self, name, elapsed):
+        stack = self._local.stack
+        children = stack.pop()
+        if stack:
+            stack[-1] += elapsed
+        else:
+            self.total += elapsed
+        self.timings[name] = (elapsed, elapsed - children)
+
+    def report(self, wall_time, limit=25):
+        """Print the slowest imports by cumulative time."""
+        print(f"\nStartup profile: {len(self.timings)} modules imported, "
+              f"{self.total * 1000:.1f} ms importing, {wall_time * 1000:.1f} ms total", file=sys.stderr)
+        print(f"  {'cumulative':>10}  {'self':>8}  module", file=sys.stderr)
+        ranked = sorted(self.timings.items(), key=lambda item: item[1][0], reverse=True)
+        for name, (cumulative, own) in ranked[:limit]:
+            print(f"  {cumulative * 1000:8.1f}ms  {own * 1000:6.1f}ms  {name}", file=sys.stderr)
+
+def cmd_sync(args):
+    """Process mail added since the last sync, or the whole retention window."""
+    from index import run_sync
+    run_sync(incremental=not args.full)
+
+def cmd_backfill(args):
+    """Process every warranty email in a date range in parallel windows without moving the sync checkpoint."""
+    from backfill import run_backfill, parse_date, default_range
+
+    if args.after or args.before:
+        if not (args.after and args.before):
+            raise SystemExit('backfill needs both --after and --before')
+        start, end = parse_date(args.after), parse_date(args.before)
+    else:
+        start, end = default_range(args.days or int(os.getenv('RETENTION_PERIOD', '5')))
+    run_backfill(start, end, window_days=args.window_days, workers=args.workers, restart=args.restart)
+
+def cmd_stats(args):
+    """Print ledger, checkpoint and upload index totals without touching Google."""
+    from ledger import get_ledger, get_ledger_path
+    from pdf_store import get_upload_index, get_upload_index_path
+    from sync_checkpoint import load_checkpoint
+
+    # Opening a missing database would create it, so report it as absent
+    if os.path.exists(get_ledger_path()):
+        stages = get_ledger().stats()
+        print(f"Ledger: {sum(stages.values())} messages")
+        for stage, count in sorted(stages.items()):
+            print(f"  {stage}: {count}")
+    else:
+        print("Ledger: none")
+
+    checkpoint = load_checkpoint()
+    if checkpoint:
+        synced_at = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(checkpoint.get('synced_at', 0)))
+        print(f"Sync checkpoint: history {checkpoint['history_id']} at {synced_at}")
+    else:
+        print("Sync checkpoint: none")
+
+    if os.path.exists(get_upload_index_path()):
+        uploads = get_upload_index().stats()
+        print(f"Drive uploads: {uploads['uploads']} files, {uploads['sessions']} unfinished sessions, "
+              f"{uploads['folders']} cached folders")
+    else:
+        print("Drive uploads: none")
+
+def cmd_cleanup(args):
+    """Delete expired submissions from Drive, expired local copies and ledger records."""
+    from gdpr_cleanup import cleanup_drive, cleanup_local_pdfs, cleanup_ledger
+    from pdf_store import get_upload_index
+
+    removed = cleanup_local_pdfs(dry_run=args.dry_run)
+    print(f"Removed {removed} expired local PDF copies")
+    print(f"Removed {cleanup_ledger(dry_run=args.dry_run)} expired ledger records")
+    if not args.dry_run:
+        print(f"Cleared {get_upload_index().clear_expired_sessions()} expired upload sessions")
+
+    if args.local_only:
+        return
+
+    folder_id = os.getenv('GOOGLE_DRIVE_FOLDER_ID')
+    if not folder_id:
+        print("GOOGLE_DRIVE_FOLDER_ID is not set, skipping Drive cleanup")
+        return
+
+    from google_services import get_service
+    print('Starting GDPR cleanup...')
+    deleted = cleanup_drive(get_service('drive'), folder_id, dry_run=args.dry_run)
+    print(f"GDPR cleanup completed, {deleted} expired files deleted")
+
+def build_parser():
+    """Build the command line parser."""
+    parser = argparse.ArgumentParser(prog='warranty', description='Warranty submissions processor')
+    parser.add_argument('--profile-startup', action='store_true',
+                        help='report how long each imported module took')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    sync = commands.add_parser('sync', help=cmd_sync.__doc__)
+    sync.add_argument('--full', action='store_true', help='scan the retention window instead of the history')
+    sync.set_defaults(func=cmd_sync)
+
+    backfill = commands.add_parser('backfill', help=cmd_backfill.__doc__)
+    backfill.add_argument('--days', type=int, help='how many days back to scan (default: RETENTION_PERIOD)')
+    backfill.add_argument('--after', help='scan mail from this date on (YYYY/MM/DD)')
+    backfill.add_argument('--before', help='scan mail before this date (YYYY/MM/DD)')
+    backfill.add_argument('--window-days', type=int, help='days per window (default: BACKFILL_WINDOW_DAYS)')
+    backfill.add_argument('--workers', type=int, help='windows processed at once (default: BACKFILL_WORKERS)')
+    backfill.add_argument('--restart', action='store_true', help='ignore windows completed by an earlier run')
+    backfill.set_defaults(func=cmd_backfill)
+
+    stats = commands.add_parser('stats', help=cmd_stats.__doc__)
+    stats.set_defaults(func=cmd_stats)
+
+    cleanup = commands.add_parser('cleanup', help=cmd_cleanup.__doc__)
+    cleanup.add_argument('--dry-run', action='store_true', help='only list what would be deleted')
+    cleanup.add_argument('--local-only', action='store_true', help='leave Drive untouched')
+    cleanup.set_defaults(func=cmd_cleanup)
+    return parser
+
+def main(argv=None):
+    """Run a CLI command."""
+    start = time.perf_counter()
+    args = build_parser().parse_args(argv)
+
+    profiler = None
+    if args.profile_startup:
+        profiler = ImportProfiler()
+        profiler.install()
+
+    try:
+        from dotenv import load_dotenv
+        load_dotenv()
+        args.func(args)
+    finally:
+        if profiler:
+            profiler.uninstall()
+            profiler.report(time.perf_counter() - start)
+
+if __name__ == '__main__':
+    main()
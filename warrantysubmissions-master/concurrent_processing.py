@@ -0,0 +1,112 @@
+import os
+from pipeline import Pipeline, Stage
+from metrics import instrument
+from ledger import FAILED
+from download_warranty_pdf import (
+    resolve_pdf_url,
+    fetch_pdf,
+    upload_to_drive,
+    build_customer_info
+)
+
+def get_worker_settings():
+    """Read worker pool sizes for the concurrent mode from the environment."""
+    return {
+        'download_workers': int(os.getenv('DOWNLOAD_WORKERS', '4')),
+        'upload_workers': int(os.getenv('UPLOAD_WORKERS', '2')),
+        'max_in_flight': int(os.getenv('MAX_IN_FLIGHT', '16'))
+    }
+
+class StageError(Exception):
+    """A pipeline stage failed for a single message."""
+
+    def __init__(self, stage, message):
+        super().__init__(message)
+        self.stage = stage
+
+def find_resumable_pdf(message_id, ledger=None):
+    """Return (True, local_pdf) when the ledger says no download is needed.
+
+    That is the case once a message got past the download stage, or when
+    its downloaded file is still on disk.
+    """
+    record = ledger.get(message_id) if ledger else None
+    if record and record['stage'] != FAILED:
+        if record['stage'] != 'downloaded':
+            return True, record.get('pdf_path')
+        if record.get('pdf_path') and os.path.exists(record['pdf_path']):
+            return True, record['pdf_path']
+    return False, None
+
+def record_download(message_id, local_pdf, ledger=None):
+    """Mark a message as downloaded in the ledger."""
+    # In-memory downloads cannot be resumed, so only files are recorded
+    if ledger and isinstance(local_pdf, str):
+        ledger.record(message_id, 'downloaded', pdf_path=local_pdf)
+
+def resolve_stage(message_id, html_content):
+    """Find and decode the PDF link of one email."""
+    actual_pdf_url = resolve_pdf_url(html_content)
+    if not actual_pdf_url:
+        raise StageError('resolve', f"No PDF link in email {message_id}")
+    return actual_pdf_url
+
+@instrument('download_stage', message_arg=0)
+def download_stage(message_id, html_content, ledger=None):
+    """Resolve and download the PDF for one email.
+
+    With a ledger, a message that already got further is not downloaded again.
+    """
+    found, local_pdf = find_resumable_pdf(message_id, ledger)
+    if found:
+        return local_pdf
+
+    local_pdf = fetch_pdf(resolve_stage(message_id, html_content))
+    if not local_pdf:
+        raise StageError('download', f"Could not download PDF for email {message_id}")
+
+    record_download(message_id, local_pdf, ledger)
+    return local_pdf
+
+@instrument('upload_stage', message_arg=0)
+def upload_stage(message_id, html_content, local_pdf, ledger=None):
+    """Upload a downloaded PDF and build the sheet row for one email.
+
+    With a ledger, a message that was already uploaded reuses its saved row.
+    """
+    record = ledger.get(message_id) if ledger else None
+    if record and record['stage'] != 'downloaded' and record.get('row_data'):
+        return record['row_data']
+
+    drive_url = upload_to_drive(local_pdf, os.getenv('GOOGLE_DRIVE_FOLDER_ID'))
+    if not drive_url:
+        raise StageError('upload', f"Could not upload PDF for email {message_id}")
+
+    customer_info = build_customer_info(html_content, drive_url)
+    if ledger:
+        ledger.record(message_id, 'uploaded', drive_link=drive_url, row_data=customer_info)
+    return customer_info
+
+def process_concurrently(emails, on_result, download_workers=4, upload_workers=2, max_in_flight=16, ledger=None):
+    """Download and upload warranty PDFs with separate bounded worker pools.
+
+    emails is an iterable of (message_id, html_content) pairs. on_result is
+    called from the calling thread with each message's report, always in the
+    order the emails were given, so sheet rows stay deterministic even when
+    downloads and uploads finish out of order. At most max_in_flight messages
+    are held at once. With a ledger, each message resumes from the last
+    stage it completed. Returns the list of reports.
+    """
+    pipeline = Pipeline(
+        [
+            Stage('download', lambda message_id, html_content: (
+                html_content, download_stage(message_id, html_content, ledger)
+            ), workers=download_workers),
+            Stage('upload', lambda message_id, downloaded: upload_stage(
+                message_id, downloaded[0], downloaded[1], ledger
+            ), workers=upload_workers)
+        ],
+        queue_size=max_in_flight,
+        max_in_flight=max_in_flight
+    )
+    return pipeline.run(emails, on_result)
@@ -0,0 +1,287 @@
+import os
+import json
+import base64
+import hmac
+import argparse
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+from index import get_google_services, sync_once, print_pool_stats
+from ledger import get_ledger
+from rate_limiter import execute_with_quota
+from sync_checkpoint import load_checkpoint
+from metrics import get_registry
+
+def get_daemon_settings():
+    """Read the push endpoint and polling settings from the environment."""
+    return {
+        'host': os.getenv('DAEMON_HOST', '127.0.0.1'),
+        'port': int(os.getenv('DAEMON_PORT', '8080')),
+        'push_path': os.getenv('DAEMON_PUSH_PATH', '/gmail/push'),
+        'push_token': os.getenv('PUSH_VERIFICATION_TOKEN'),
+        'poll_seconds': float(os.getenv('DAEMON_POLL_SECONDS', '300')),
+        'debounce_seconds': float(os.getenv('DAEMON_DEBOUNCE_SECONDS', '1')),
+        'topic': os.getenv('GMAIL_PUBSUB_TOPIC'),
+        'watch_renew_seconds': float(os.getenv('GMAIL_WATCH_RENEW_SECONDS', str(24 * 60 * 60)))
+    }
+
+def decode_push_notification(body):
+    """Decode a Pub/Sub push request body into the Gmail notification it carries.
+
+    Returns a dict with the mailbox's email_address and new history_id.
+    Raises ValueError for anything that is not a Gmail notification.
+    """
+    try:
+        envelope = json.loads(body)
+        message = envelope['message']
+        data = json.loads(base64.b64decode(message['data']))
+        return {
+            'email_address': data.get('emailAddress'),
+            'history_id': int(data['historyId']),
+            'message_id': message.get('messageId') or message.get('message_id')
+        }
+    except (ValueError, KeyError, TypeError) as e:
+        raise ValueError(f"Not a Gmail push notification: {e}") from e
+
+def start_watch(gmail_service, topic):
+    """Ask Gmail to publish mailbox changes to a Pub/Sub topic.
+
+    A watch lasts at most seven days, so it has to be renewed regularly.
+    """
+    response = execute_with_quota(
+        gmail_service.users().watch(userId='me', body={'topicName': topic}),
+        'gmail',
+        'watch'
+    )
+    print(f"Watching mailbox via {topic} until {response.get('expiration')}")
+    return response
+
+class SyncWorker:
+    """Run incremental syncs on one thread, woken by push notifications.
+
+    Notifications only wake the worker; it then lists everything added since
+    the sync checkpoint, so a burst of notifications is handled by one sync
+    and a lost one is picked up by the next. Without any notification the
+    worker still syncs every poll_seconds.
+    """
+
+    def __init__(self, poll_seconds=300, debounce_seconds=1, topic=None, watch_renew_seconds=86400):
+        self.poll_seconds = poll_seconds
+        self.debounce_seconds = debounce_seconds
+        self.topic = topic
+        self.watch_renew_seconds = watch_renew_seconds
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+        self._latest_history_id = 0
+        self._thread = None
+        self.syncs = 0
+        self.processed = 0
+        self.notifications = 0
+        self.last_sync = None
+
+    def start(self):
+        """Start the sync thread."""
+        self._thread = threading.Thread(target=self._run, name='sync-worker', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=30):
+        """Stop after the current sync finishes."""
+        self._stopping.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def notify(self, history_id=None):
+        """Wake the worker for a change up to history_id."""
+        with self._lock:
+            self.notifications += 1
+            if history_id:
+                self._latest_history_id = max(self._latest_history_id, history_id)
+        self._wake.set()
+
+    def stats(self):
+        """Return counters for the health endpoint."""
+        with self._lock:
+            return {
+                'syncs': self.syncs,
+                'processed': self.processed,
+                'notifications': self.notifications,
+                'last_sync': self.last_sync
+            }
+
+    def _is_up_to_date(self):
+        """True when every notified change is already behind the checkpoint."""
+        checkpoint = load_checkpoint()
+        with self._lock:
+            latest = self._latest_history_id
+        return bool(checkpoint and latest and int(checkpoint['history_id']) >= latest)
+
+    def _run(self):
+        # Clients are thread-local, so build them on the thread that uses them
+        gmail_service, sheets_service = get_google_services()
+        ledger = get_ledger()
+        watch_started = 0
+
+        woken = False
+        while not self._stopping.is_set():
+            if self.topic and time.monotonic() - watch_started >= self.watch_renew_seconds:
+                try:
+                    start_watch(gmail_service, self.topic)
+                    watch_started = time.monotonic()
+                except Exception as e:
+                    print(f"Error starting Gmail watch: {e}")
+
+            if woken and self._is_up_to_date():
+                print("Notification already covered by the last sync")
+            else:
+                self._sync(gmail_service, sheets_service, ledger)
+
+            woken = self._wake.wait(timeout=self.poll_seconds)
+            if woken and not self._stopping.is_set():
+                # Let a burst of notifications settle into one sync
+                time.sleep(self.debounce_seconds)
+            self._wake.clear()
+
+    def _sync(self, gmail_service, sheets_service, ledger):
+        """Run one incremental sync, keeping the worker alive on failure."""
+        try:
+            count = sync_once(gmail_service, sheets_service, ledger, incremental=True)
+        except Exception as e:
+            print(f"Error syncing warranty emails: {e}")
+            return
+
+        with self._lock:
+            self.syncs += 1
+            self.processed += count
+            self.last_sync = int(time.time())
+        if count:
+            print(f"Processed {count} warranty form emails")
+            print_pool_stats()
+
+class PushHandler(BaseHTTPRequestHandler):
+    """Accept Gmail push notifications from Pub/Sub and serve a health check."""
+
+    def do_POST(self):
+        settings = self.server.settings
+        url = urlparse(self.path)
+        if url.path != settings['push_path']:
+            self._respond(404)
+            return
+
+        if settings['push_token']:
+            # Constant-time, so response timing does not leak the token
+            token = parse_qs(url.query).get('token', [''])[0]
+            if not hmac.compare_digest(token.encode('utf-8'), settings['push_token'].encode('utf-8')):
+                self._respond(403)
+                return
+
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        try:
+            notification = decode_push_notification(body)
+        except ValueError as e:
+            # Acknowledge anyway; Pub/Sub would keep redelivering a bad message
+            print(f"Ignoring push request: {e}")
+            self._respond(204)
+            return
+
+        print(f"Push notification for {notification['email_address']} at history {notification['history_id']}")
+        self.server.worker.notify(notification['history_id'])
+        self._respond(204)
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path == '/health':
+            self._respond(200, {'status': 'ok', **self.server.worker.stats()})
+        elif path == '/metrics' and get_registry() is not None:
+            body = get_registry().to_openmetrics().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/openmetrics-text; version=1.0.0; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        else:
+            self._respond(404)
+
+    def _respond(self, status, payload=None):
+        body = json.dumps(payload).encode('utf-8') if payload is not None else b''
+        self.send_response(status)
+        if payload is not None:
+            self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Request lines are noise next to the sync output
+        pass
+
+def create_server(worker, settings=None):
+    """Create the push receiver HTTP server for a sync worker."""
+    settings = settings or get_daemon_settings()
+    server = ThreadingHTTPServer((settings['host'], settings['port']), PushHandler)
+    server.daemon_threads = True
+    server.worker = worker
+    server.settings = settings
+    return server
+
+def run_daemon():
+    """Keep warm clients, sync on push notifications and poll as a fallback."""
+    settings = get_daemon_settings()
+    worker = SyncWorker(
+        poll_seconds=settings['poll_seconds'],
+        debounce_seconds=settings['debounce_seconds'],
+        topic=settings['topic'],
+        watch_renew_seconds=settings['watch_renew_seconds']
+    )
+    server = create_server(worker, settings)
+
+    worker.start()
+    print(f"Listening for Gmail push notifications on "
+          f"http://{settings['host']}:{settings['port']}{settings['push_path']}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("Shutting down")
+    finally:
+        server.server_close()
+        worker.stop()
+
+def send_fake_push(url, history_id, email_address='warranty@example.com', token=None):
+    """Post a Pub/Sub-style Gmail notification to a push endpoint, for testing."""
+    # Only this test helper needs requests, so the daemon does not import it
+    import requests
+
+    data = json.dumps({'emailAddress': email_address, 'historyId': history_id})
+    envelope = {
+        'message': {
+            'data': base64.b64encode(data.encode('utf-8')).decode('ascii'),
+            'messageId': str(int(time.time() * 1000)),
+            'publishTime': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+        },
+        'subscription': 'projects/local/subscriptions/fake-push'
+    }
+    params = {'token': token} if token else None
+    response = requests.post(url, json=envelope, params=params, timeout=10)
+    print(f"Fake push for history {history_id}: HTTP {response.status_code}")
+    return response.status_code
+
+def main():
+    """Run the daemon, or send it a fake push notification."""
+    parser = argparse.ArgumentParser(description='Warranty processor daemon')
+    parser.add_argument('--fake-push', type=int, metavar='HISTORY_ID',
+                        help='send a fake Gmail push notification instead of running')
+    parser.add_argument('--url', help='push endpoint for --fake-push')
+    args = parser.parse_args()
+
+    if args.fake_push is not None:
+        settings = get_daemon_settings()
+        url = args.url or f"http://{settings['host']}:{settings['port']}{settings['push_path']}"
+        send_fake_push(url, args.fake_push, token=settings['push_token'])
+        return
+
+    run_daemon()
+
+if __name__ == '__main__':
+    main()
@@ -1,88 +1,161 @@
-import requests
 import base64
 import re
 from urllib.parse import unquote
-from bs4 import BeautifulSoup
+from html_extract import as_parsed_email
 import os
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.transport.requests import Request
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaFileUpload
-import pickle
+import tempfile
+import hashlib
+import io
+import json
+import functools
+from contextlib import nullcontext
+from http_session import get_http_session
+from googleapiclient.errors import HttpError
+from googleapiclient.http import MediaIoBaseUpload
+from google_services import get_service
+from pdf_store import store_pdf, file_digest, get_upload_index
+from rate_limiter import call_with_quota
+from gdpr_cleanup import gdpr_expiry_date
+from drive_folders import get_upload_folder, get_folder_layout, forget_upload_folders
+from metrics import instrument, count, record_bytes, record_retry
+from url_cache import get_url_cache, conditional_headers
 
 def get_drive_service():
-    """Get or create Google Drive API service."""
-    creds = None
-    
-    # Load existing credentials if available
-    if os.path.exists('token.pickle'):
-        with open('token.pickle', 'rb') as token:
-            creds = pickle.load(token)
-    
-    # Refresh/create credentials if needed
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
+    """Get the cached Google Drive API service."""
+    return get_service('drive')
+
+def get_upload_chunk_size():
+    """Return the Drive upload chunk size, a multiple of 256 KiB as Drive requires."""
+    chunk_size = int(os.getenv('DRIVE_UPLOAD_CHUNK_SIZE', str(8 * 1024 * 1024)))
+    return max(256 * 1024, chunk_size - chunk_size % (256 * 1024))
+
+def _query_upload_progress(request, size):
+    """Ask Drive how much of a saved resumable session it already has.
+    
+    Returns (bytes received, finished file or None), or None when the
+    session has expired and the upload has to start over.
+    """
+    resp, content = request.http.request(
+        request.resumable_uri,
+        'PUT',
+        headers={'Content-Range': f"bytes */{size}", 'content-length': '0'}
+    )
+    if resp.status in (200, 201):
+        return size, json.loads(content)
+    if resp.status == 308:
+        received = resp.get('range')
+        return (int(received.split('-')[-1]) + 1 if received else 0), None
+    return None
+
+def _run_resumable_upload(request, size, digest, upload_index):
+    """Send a resumable upload chunk by chunk, saving the session URI as it goes."""
+    session = upload_index.get_session(digest)
+    if session and session['size'] == size:
+        request.resumable_uri = session['uri']
+        progress = _query_upload_progress(request, size)
+        if progress is None:
+            request.resumable_uri = None
         else:
-            flow = InstalledAppFlow.from_client_config({
-                "installed": {
-                    "client_id": os.getenv('GOOGLE_CLIENT_ID'),
-                    "client_secret": os.getenv('GOOGLE_CLIENT_SECRET'),
-                    "redirect_uris": [os.getenv('GOOGLE_REDIRECT_URI')],
-                    "auth_uri": "https://accounts.google.com/o/oauth2/auth",
-                    "token_uri": "https://oauth2.googleapis.com/token"
-                }
-            }, ['https://www.googleapis.com/auth/drive.file'])
-            creds = flow.run_local_server(port=0)
-        
-        # Save credentials for future use
-        with open('token.pickle', 'wb') as token:
-            pickle.dump(creds, token)
-    
-    return build('drive', 'v3', credentials=creds)
-
-def upload_to_drive(file_path, folder_id=None):
-    """Upload a file to Google Drive and return its URL."""
+            received, file = progress
+            if file:
+                return file
+            request.resumable_progress = received
+            print(f"Resuming Drive upload at {received} of {size} bytes")
+    
+    # Each chunk is one Drive request; a rate-limited chunk is resent from
+    # the last byte Drive acknowledged
+    file = None
+    while file is None:
+        status, file = call_with_quota('drive', 'files.create', request.next_chunk)
+        if file is None and request.resumable_uri:
+            upload_index.save_session(digest, request.resumable_uri, size)
+    
+    upload_index.clear_session(digest)
+    return file
+
+@instrument('upload_to_drive')
+def upload_to_drive(source, folder_id=None, name=None, digest=None):
+    """Upload a file to Google Drive and return its URL.
+    
+    source is a file path, or a downloaded PDF dict holding an in-memory
+    buffer (see download_pdf_to_memory), which is uploaded straight from
+    memory. Uploads are chunked and resumable; the session URI is saved so
+    an interrupted upload continues where it stopped on the next run.
+    Content that was uploaded before is not sent again; the existing
+    Drive link is returned instead.
+    """
     try:
+        if isinstance(source, dict):
+            name = name or source['filename']
+            digest = digest or source['sha256']
+            stream = source['buffer']
+            stream.seek(0)
+        else:
+            name = name or os.path.basename(source)
+            digest = digest or file_digest(source)
+            stream = None
+        
+        # Skip the upload when identical content is already in Drive
+        upload_index = get_upload_index()
+        existing = upload_index.get(digest)
+        if existing:
+            print(f"File already in Drive: {existing['web_view_link']}")
+            return existing['web_view_link']
+        
         drive_service = get_drive_service()
         
         file_metadata = {
-            'name': os.path.basename(file_path)
+            'name': name,
+            # Lets the GDPR cleanup find and delete the file once it expires
+            'appProperties': {'gdprExpiryDate': gdpr_expiry_date()}
         }
         
         if folder_id:
-            file_metadata['parents'] = [folder_id]
+            # With the monthly layout this is root/YYYY/MM, cached after first use
+            file_metadata['parents'] = [get_upload_folder(drive_service, folder_id)]
         
-        media = MediaFileUpload(
-            file_path,
-            mimetype='application/pdf',
-            resumable=True
-        )
-        
-        file = drive_service.files().create(
-            body=file_metadata,
-            media_body=media,
-            fields='id, webViewLink'
-        ).execute()
+        # Leave in-memory buffers open; the caller owns them
+        with (nullcontext(stream) if stream else open(source, 'rb')) as f:
+            media = MediaIoBaseUpload(
+                f,
+                mimetype='application/pdf',
+                chunksize=get_upload_chunk_size(),
+                resumable=True
+            )
+            
+            request = drive_service.files().create(
+                body=file_metadata,
+                media_body=media,
+                fields='id, webViewLink'
+            )
+            file = _run_resumable_upload(request, media.size(), digest, upload_index)
+            record_bytes('upload', media.size())
         
+        upload_index.record(digest, file.get('id'), file.get('webViewLink'))
         print(f"File uploaded to Drive: {file.get('webViewLink')}")
         return file.get('webViewLink')
     
     except Exception as e:
+        if isinstance(e, HttpError) and e.resp.status == 404 and get_folder_layout() == 'monthly':
+            # A cached month folder was deleted in Drive; look it up again next time
+            forget_upload_folders()
         print(f"Error uploading to Drive: {e}")
         return None
 
 def extract_pdf_url_from_html(html_content):
-    """Extract the PDF URL from the email HTML content."""
-    soup = BeautifulSoup(html_content, 'html.parser')
-    pdf_link = soup.find('a', text=lambda t: t and t.endswith('.pdf'))
-    if pdf_link:
-        return pdf_link.get('href')
-    return None
+    """Extract the PDF URL from the email HTML content.
+    
+    Timed by ParsedEmail, so a link already parsed is not counted again.
+    """
+    return as_parsed_email(html_content).pdf_href
 
+@functools.lru_cache(maxsize=4096)
 def decode_globo_url(url):
-    """Decode the globo URL to get the actual PDF URL."""
+    """Decode the globo URL to get the actual PDF URL.
+    
+    The same link shows up again on every scan of the retention window, so
+    decoded URLs are memoised.
+    """
     # Extract the 'ext' parameter
     ext_match = re.search(r'ext=([^&]+)', url)
     if ext_match:
@@ -98,43 +171,164 @@ def decode_globo_url(url):
             print(f"Error decoding URL: {e}")
     return None
 
-def download_pdf(url, output_dir="downloaded_pdfs"):
-    """Download the PDF file following redirects."""
+def get_download_settings():
+    """Read PDF download limits from the environment."""
+    return {
+        'timeout': (
+            float(os.getenv('PDF_CONNECT_TIMEOUT', '10')),
+            float(os.getenv('PDF_READ_TIMEOUT', '60'))
+        ),
+        'max_bytes': int(os.getenv('PDF_MAX_BYTES', str(50 * 1024 * 1024))),
+        'chunk_size': int(os.getenv('PDF_CHUNK_SIZE', str(64 * 1024)))
+    }
+
+def get_pdf_filename(response, url):
+    """Pick a local filename from Content-Disposition or the URL."""
+    filename = None
+    if 'Content-Disposition' in response.headers:
+        cd = response.headers['Content-Disposition']
+        if 'filename=' in cd:
+            filename = re.findall("filename=(.+)", cd)[0].strip('"')
+    
+    if not filename:
+        # Use the last part of the URL as filename
+        filename = url.split('/')[-1]
+        if not filename.endswith('.pdf'):
+            filename = 'warranty_form.pdf'
+    
+    # Never let a header choose a path outside the output directory
+    return os.path.basename(filename)
+
+def _stream_pdf(url, sink, timeout, max_bytes, chunk_size, headers=None):
+    """Stream a PDF into sink, hashing as it arrives.
+    
+    Returns (filename, sha256, size, validators), where validators holds the
+    response's ETag and Last-Modified, or None when a conditional request in
+    headers was answered with 304 Not Modified.
+    """
+    # Reuse pooled keep-alive connections to the CDN
+    session = get_http_session()
+    with session.get(url, allow_redirects=True, stream=True, timeout=timeout, headers=headers) as response:
+        if response.status_code == 304:
+            return None
+        response.raise_for_status()
+        
+        # Reject oversized files before reading the body
+        content_length = response.headers.get('Content-Length')
+        if content_length and int(content_length) > max_bytes:
+            raise ValueError(f"PDF is {content_length} bytes, limit is {max_bytes}")
+        
+        filename = get_pdf_filename(response, url)
+        validators = {
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified')
+        }
+        
+        sha256 = hashlib.sha256()
+        size = 0
+        for chunk in response.iter_content(chunk_size=chunk_size):
+            size += len(chunk)
+            if size > max_bytes:
+                raise ValueError(f"PDF exceeds size limit of {max_bytes} bytes")
+            sha256.update(chunk)
+            sink.write(chunk)
+        
+        # urllib3 keeps the retries it made for this response
+        retries = getattr(getattr(response.raw, 'retries', None), 'history', None)
+        if retries:
+            record_retry('download_pdf', len(retries))
+    
+    record_bytes('download', size)
+    return filename, sha256.hexdigest(), size, validators
+
+@instrument('download_pdf')
+def download_pdf(url, output_dir="downloaded_pdfs", timeout=None, max_bytes=None, chunk_size=None):
+    """Download the PDF file following redirects.
+    
+    The body is streamed to a temporary file in output_dir, hashed on the
+    way, and renamed into the content-addressed store once complete. Partial
+    downloads never appear under a final name, memory use does not grow with
+    the PDF size, and identical PDFs are stored only once.
+    
+    A URL downloaded before is fetched with a conditional GET against its
+    cached ETag and Last-Modified; a 304 is answered from the local copy.
+    """
+    settings = get_download_settings()
+    timeout = timeout or settings['timeout']
+    max_bytes = max_bytes or settings['max_bytes']
+    chunk_size = chunk_size or settings['chunk_size']
+    
+    temp_path = None
     try:
         # Create output directory if it doesn't exist
         os.makedirs(output_dir, exist_ok=True)
-
-        # First request to get the redirect
-        session = requests.Session()
-        response = session.get(url, allow_redirects=True)
         
-        # Get filename from Content-Disposition header or URL
-        filename = None
-        if 'Content-Disposition' in response.headers:
-            cd = response.headers['Content-Disposition']
-            if 'filename=' in cd:
-                filename = re.findall("filename=(.+)", cd)[0].strip('"')
+        url_cache = get_url_cache()
+        cached = url_cache.get(url) if url_cache else None
+        headers = conditional_headers(cached) if cached else None
         
-        if not filename:
-            # Use the last part of the URL as filename
-            filename = url.split('/')[-1]
-            if not filename.endswith('.pdf'):
-                filename = 'warranty_form.pdf'
-
-        output_path = os.path.join(output_dir, filename)
+        # Stream the PDF into a temporary file next to the store
+        fd, temp_path = tempfile.mkstemp(dir=output_dir, suffix='.part')
+        with os.fdopen(fd, 'wb') as f:
+            result = _stream_pdf(url, f, timeout, max_bytes, chunk_size, headers)
+        
+        if result is None:
+            url_cache.revalidated(url)
+            count('url_cache', outcome='not_modified')
+            print(f"PDF not modified, using local copy: {cached['local_path']}")
+            return cached['local_path']
+        
+        filename, digest, size, validators = result
+        output_path = store_pdf(temp_path, output_dir, digest, filename)
+        temp_path = None
         
-        # Save the PDF
-        with open(output_path, 'wb') as f:
-            f.write(response.content)
+        if url_cache and (validators['etag'] or validators['last_modified']):
+            url_cache.record(url, output_path, digest, size, **validators)
+        count('url_cache', outcome='revalidated_changed' if cached else 'miss')
         
         print(f"PDF downloaded successfully to: {output_path}")
         return output_path
     except Exception as e:
         print(f"Error downloading PDF: {e}")
         return None
+    finally:
+        if temp_path and os.path.exists(temp_path):
+            os.remove(temp_path)
 
-def process_warranty_email(html_content):
-    """Process warranty email HTML, download the PDF, and upload to Drive."""
+@instrument('download_pdf')
+def download_pdf_to_memory(url, timeout=None, max_bytes=None, chunk_size=None):
+    """Download the PDF into memory without touching disk.
+    
+    Returns a dict with the buffer, filename, sha256 and size, ready to be
+    passed to upload_to_drive, or None on failure.
+    """
+    settings = get_download_settings()
+    timeout = timeout or settings['timeout']
+    max_bytes = max_bytes or settings['max_bytes']
+    chunk_size = chunk_size or settings['chunk_size']
+    
+    try:
+        buffer = io.BytesIO()
+        filename, digest, size, _ = _stream_pdf(url, buffer, timeout, max_bytes, chunk_size)
+        print(f"PDF downloaded into memory: {filename} ({size} bytes)")
+        return {
+            'buffer': buffer,
+            'filename': filename,
+            'sha256': digest,
+            'size': size
+        }
+    except Exception as e:
+        print(f"Error downloading PDF: {e}")
+        return None
+
+def fetch_pdf(url):
+    """Download a PDF to disk, or into memory when PDF_STORAGE=memory."""
+    if os.getenv('PDF_STORAGE', 'disk') == 'memory':
+        return download_pdf_to_memory(url)
+    return download_pdf(url)
+
+def resolve_pdf_url(html_content):
+    """Find the PDF link in warranty email HTML and decode it to the CDN URL."""
     # Extract the initial URL
     pdf_url = extract_pdf_url_from_html(html_content)
     if not pdf_url:
@@ -147,18 +341,15 @@ def process_warranty_email(html_content):
         print("Could not decode PDF URL")
         return None
     
-    # Download the PDF
-    local_pdf_path = download_pdf(actual_pdf_url)
-    if not local_pdf_path:
-        return None
-    
-    # Upload to Drive
-    drive_url = upload_to_drive(local_pdf_path, os.getenv('GOOGLE_DRIVE_FOLDER_ID'))
-    if not drive_url:
-        return None
-    
+    return actual_pdf_url
+
+def build_customer_info(html_content, drive_url):
+    """Build the customer information row for a processed warranty email."""
     # Extract customer information from the email
-    soup = BeautifulSoup(html_content, 'html.parser')
+    fields, missing = as_parsed_email(html_content).form_fields
+    if missing:
+        print(f"Warranty form fields missing from email: {', '.join(missing)}")
+    
     customer_info = {
         'customer_name': '',
         'email': '',
@@ -167,14 +358,34 @@ def process_warranty_email(html_content):
         'product_model': '',
         'serial_number': '',
         'purchase_date': '',
-        'pdf_url': drive_url
+        'pdf_url': drive_url,
+        'missing_fields': missing
     }
-    
-    # Add logic here to extract customer information from the email
-    # This will depend on your email format
+    customer_info.update(fields)
     
     return customer_info
 
+def process_warranty_email(html_content):
+    """Process warranty email HTML, download the PDF, and upload to Drive."""
+    # Parse the email once for both the PDF link and customer details
+    html_content = as_parsed_email(html_content)
+    
+    actual_pdf_url = resolve_pdf_url(html_content)
+    if not actual_pdf_url:
+        return None
+    
+    # Download the PDF
+    local_pdf = fetch_pdf(actual_pdf_url)
+    if not local_pdf:
+        return None
+    
+    # Upload to Drive
+    drive_url = upload_to_drive(local_pdf, os.getenv('GOOGLE_DRIVE_FOLDER_ID'))
+    if not drive_url:
+        return None
+    
+    return build_customer_info(html_content, drive_url)
+
 # Example usage
 if __name__ == "__main__":
     # Example HTML content (replace with actual email HTML)
@@ -0,0 +1,118 @@
+import os
+import threading
+from datetime import datetime, timezone
+from pdf_store import get_upload_index
+from rate_limiter import execute_with_quota
+
+FOLDER_MIME_TYPE = 'application/vnd.google-apps.folder'
+
+# One lock per (parent, name), so concurrent uploads create a folder once
+_folder_locks = {}
+_folder_locks_lock = threading.Lock()
+
+def get_folder_layout():
+    """Return the Drive folder layout: 'flat' (default) or 'monthly'."""
+    return os.getenv('DRIVE_FOLDER_LAYOUT', 'flat')
+
+def shard_names(when=None):
+    """Return the (year, month) folder names for a time, e.g. ('2025', '04')."""
+    when = when or datetime.now(timezone.utc)
+    return f"{when:%Y}", f"{when:%m}"
+
+def _quote(value):
+    """Quote a string for a Drive search query."""
+    return "'" + value.replace('\\', '\\\\').replace("'", "\\'") + "'"
+
+def list_folders(drive_service, parent_id, name=None):
+    """List the subfolders of a Drive folder, oldest first, optionally by name."""
+    query = f"{_quote(parent_id)} in parents and mimeType = '{FOLDER_MIME_TYPE}' and trashed = false"
+    if name is not None:
+        query += f" and name = {_quote(name)}"
+
+    folders = []
+    page_token = None
+    while True:
+        response = execute_with_quota(
+            drive_service.files().list(
+                q=query,
+                fields='nextPageToken, files(id, name, createdTime)',
+                spaces='drive',
+                orderBy='createdTime',
+                pageSize=1000,
+                pageToken=page_token
+            ),
+            'drive',
+            'files.list'
+        )
+        folders.extend(response.get('files', []))
+        page_token = response.get('nextPageToken')
+        if not page_token:
+            return folders
+
+def find_or_create_folder(drive_service, parent_id, name):
+    """Return the ID of the named subfolder, creating it if it does not exist.
+
+    Drive allows duplicate names, so the oldest folder with the name always
+    wins: after creating one, the listing is repeated and a folder created
+    concurrently by another process is adopted instead of ours, which is
+    deleted while still empty. Found IDs are cached in the upload index, so
+    each folder costs Drive calls only the first time it is needed.
+    """
+    upload_index = get_upload_index()
+    folder_id = upload_index.get_folder(parent_id, name)
+    if folder_id:
+        return folder_id
+
+    with _folder_locks_lock:
+        lock = _folder_locks.setdefault((parent_id, name), threading.Lock())
+    with lock:
+        # Another thread may have created it while we waited
+        folder_id = upload_index.get_folder(parent_id, name)
+        if folder_id:
+            return folder_id
+
+        existing = list_folders(drive_service, parent_id, name)
+        if existing:
+            folder_id = existing[0]['id']
+        else:
+            created = execute_with_quota(
+                drive_service.files().create(
+                    body={'name': name, 'mimeType': FOLDER_MIME_TYPE, 'parents': [parent_id]},
+                    fields='id'
+                ),
+                'drive',
+                'files.create'
+            )
+            folder_id = created['id']
+            print(f"Created Drive folder {name} in {parent_id}")
+
+            winner = next(iter(list_folders(drive_service, parent_id, name)), None)
+            if winner and winner['id'] != folder_id:
+                print(f"Drive folder {name} was created concurrently, using {winner['id']}")
+                execute_with_quota(drive_service.files().delete(fileId=folder_id), 'drive', 'files.delete')
+                folder_id = winner['id']
+
+        upload_index.record_folder(parent_id, name, folder_id)
+        return folder_id
+
+def get_upload_folder(drive_service, root_id, when=None):
+    """Return the folder a new upload goes into under root_id.
+
+    With DRIVE_FOLDER_LAYOUT=monthly that is root/YYYY/MM for the upload
+    time, so no folder grows past one month of submissions and a retention
+    scan can skip every month that cannot have expired yet.
+    """
+    if get_folder_layout() != 'monthly':
+        return root_id
+
+    year, month = shard_names(when)
+    year_id = find_or_create_folder(drive_service, root_id, year)
+    return find_or_create_folder(drive_service, year_id, month)
+
+def forget_upload_folders():
+    """Drop the cached folder IDs after Drive reported a cached folder missing.
+
+    Both levels are dropped, since a stale month may sit under a stale year;
+    the next upload looks them up again.
+    """
+    get_upload_index().clear_folders()
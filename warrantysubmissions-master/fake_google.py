@@ -0,0 +1,253 @@
+import base64
+import random
+import re
+import threading
+import time
+from email.message import EmailMessage
+import httplib2
+from googleapiclient.errors import HttpError
+
+# In-process stand-ins for the Gmail, Drive and Sheets clients, shaped like
+# the googleapiclient resources the processor calls. Every call sleeps for
+# the configured latency and fails with the configured error rate, so the
+# benchmark can measure throughput without touching Google.
+
+def make_http_error(status, reason=None):
+    """Build an HttpError like the ones googleapiclient raises."""
+    content = b'{"error": {"code": %d, "errors": [{"reason": "%s"}]}}' % (status, (reason or 'backendError').encode())
+    return HttpError(httplib2.Response({'status': status}), content)
+
+class FaultInjector:
+    """Latency and error injection shared by the fake services."""
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, error_status=429, seed=None, on_call=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.on_call = on_call
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.errors = 0
+
+    def should_fail(self):
+        """Decide whether the next call fails, counting the failure."""
+        with self._lock:
+            failed = self._random.random() < self.error_rate
+            if failed:
+                self.errors += 1
+        return failed
+
+    def call(self, name):
+        """Simulate one round trip, raising an injected error if one is due."""
+        with self._lock:
+            self.calls += 1
+            delay = self.latency + self._random.uniform(0, self.jitter)
+        failed = self.should_fail()
+
+        start = time.perf_counter()
+        if delay:
+            time.sleep(delay)
+        if self.on_call:
+            self.on_call(name, time.perf_counter() - start)
+        if failed:
+            reason = 'rateLimitExceeded' if self.error_status in (403, 429) else None
+            raise make_http_error(self.error_status, reason)
+
+class _Request:
+    """A request whose execute() runs through the fault injector."""
+
+    def __init__(self, faults, name, func):
+        self.faults = faults
+        self.name = name
+        self.func = func
+
+    def execute(self, num_retries=0):
+        self.faults.call(self.name)
+        return self.func()
+
+class _Resource:
+    """Attribute access returns the child resource or method named."""
+
+    def __init__(self, **members):
+        self.__dict__.update(members)
+
+def make_raw_message(message_id, html):
+    """Encode an HTML email the way Gmail returns format=raw messages."""
+    message = EmailMessage()
+    message['Subject'] = 'New Warranty Form Submission'
+    message['From'] = 'forms@globosoftware.net'
+    message['To'] = 'warranty@example.com'
+    message['Message-ID'] = f"<{message_id}@example.com>"
+    message.set_content('A new warranty form was submitted.')
+    message.add_alternative(html, subtype='html')
+    return base64.urlsafe_b64encode(message.as_bytes()).decode('ascii')
+
+class FakeGmail:
+    """Fake Gmail client serving a synthetic mailbox.
+
+    mailbox maps message ID to email HTML. Supports messages.list with
+    pagination, messages.get in raw or full format, batch requests and
+    getProfile.
+    """
+
+    def __init__(self, mailbox, faults=None, history_id=1000):
+        self.mailbox = mailbox
+        self.ids = list(mailbox)
+        self.faults = faults or FaultInjector()
+        self.history_id = history_id
+        # Encoding MIME is the fake's own cost, so do it once per message
+        self._raw = {}
+
+    def users(self):
+        return _Resource(
+            messages=lambda: _Resource(list=self._list, get=self._get),
+            getProfile=lambda userId: _Request(self.faults, 'gmail.getProfile',
+                                               lambda: {'historyId': str(self.history_id)})
+        )
+
+    def new_batch_http_request(self, callback=None):
+        return _FakeBatch(self.faults, callback)
+
+    def _list(self, userId, q=None, maxResults=100, pageToken=None):
+        def run():
+            start = int(pageToken or 0)
+            end = start + maxResults
+            page = {'messages': [{'id': message_id} for message_id in self.ids[start:end]]}
+            if end < len(self.ids):
+                page['nextPageToken'] = str(end)
+            return page
+        return _Request(self.faults, 'gmail.list', run)
+
+    def _get(self, userId, id, format='full', fields=None):
+        def run():
+            if id not in self.mailbox:
+                raise make_http_error(404, 'notFound')
+            html = self.mailbox[id]
+            if format == 'raw':
+                if id not in self._raw:
+                    self._raw[id] = make_raw_message(id, html)
+                return {'id': id, 'raw': self._raw[id]}
+            data = base64.urlsafe_b64encode(html.encode('utf-8')).decode('ascii')
+            return {
+                'id': id,
+                'payload': {
+                    'mimeType': 'text/html',
+                    'headers': [{'name': 'Content-Type', 'value': 'text/html; charset="utf-8"'}],
+                    'body': {'data': data}
+                }
+            }
+        return _Request(self.faults, 'gmail.get', run)
+
+class _FakeBatch:
+    """Batch request: one round trip, per-request results or errors."""
+
+    def __init__(self, faults, callback):
+        self.faults = faults
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, request_id=None, callback=None):
+        self.requests.append((request_id, request, callback or self.callback))
+
+    def execute(self):
+        self.faults.call('gmail.batch')
+        for request_id, request, callback in self.requests:
+            # Each sub-request may fail on its own, like in a real batch
+            try:
+                if self.faults.should_fail():
+                    raise make_http_error(self.faults.error_status, 'rateLimitExceeded')
+                response, exception = request.func(), None
+            except HttpError as e:
+                response, exception = None, e
+            callback(request_id, response, exception)
+
+class _FakeUpload:
+    """Resumable upload request that accepts one chunk per next_chunk()."""
+
+    def __init__(self, drive, body, media_body):
+        self.drive = drive
+        self.body = body
+        self.media = media_body
+        self.resumable_uri = None
+        self.resumable_progress = 0
+
+    def next_chunk(self, num_retries=0):
+        self.drive.faults.call('drive.chunk')
+        size = self.media.size()
+        chunk = self.media.getbytes(self.resumable_progress, self.media.chunksize())
+        self.resumable_progress += len(chunk)
+        if self.resumable_uri is None:
+            self.resumable_uri = f"fake://upload/{id(self)}"
+        if self.resumable_progress < size:
+            return None, None
+        return None, self.drive.store(self.body, self.resumable_progress)
+
+class FakeDrive:
+    """Fake Drive client that records uploaded files and created folders.
+
+    files.list understands the "'<id>' in parents", mimeType and name
+    clauses this codebase sends.
+    """
+
+    def __init__(self, faults=None):
+        self.faults = faults or FaultInjector()
+        self.files_created = []
+        self._lock = threading.Lock()
+
+    def files(self):
+        return _Resource(create=self._create, list=self._list, delete=self._delete)
+
+    def store(self, body, size):
+        with self._lock:
+            file_id = f"file{len(self.files_created)}"
+            self.files_created.append({'id': file_id, 'size': size, 'createdTime': f"{len(self.files_created):012d}", **body})
+        return {'id': file_id, 'webViewLink': f"https://drive.example.com/{file_id}"}
+
+    def _create(self, body=None, media_body=None, fields=None):
+        if media_body is None:
+            return _Request(self.faults, 'drive.create', lambda: self.store(body or {}, 0))
+        return _FakeUpload(self, body or {}, media_body)
+
+    def _list(self, q=None, fields=None, spaces=None, orderBy=None, pageSize=100, pageToken=None):
+        def matches(file):
+            for clause in re.findall(r"'((?:[^'\\]|\\.)*)' in parents", q or ''):
+                if clause not in file.get('parents', []):
+                    return False
+            for key in ('mimeType', 'name'):
+                match = re.search(rf"{key} = '((?:[^'\\]|\\.)*)'", q or '')
+                if match and file.get(key) != re.sub(r'\\(.)', r'\1', match.group(1)):
+                    return False
+            return True
+
+        def run():
+            with self._lock:
+                return {'files': [file for file in self.files_created if matches(file)]}
+        return _Request(self.faults, 'drive.list', run)
+
+    def _delete(self, fileId):
+        def run():
+            with self._lock:
+                self.files_created = [file for file in self.files_created if file['id'] != fileId]
+        return _Request(self.faults, 'drive.delete', run)
+
+class FakeSheets:
+    """Fake Sheets client that appends rows to an in-memory sheet."""
+
+    def __init__(self, faults=None):
+        self.faults = faults or FaultInjector()
+        self.rows = []
+        self._lock = threading.Lock()
+
+    def spreadsheets(self):
+        return _Resource(values=lambda: _Resource(append=self._append))
+
+    def _append(self, spreadsheetId=None, range=None, valueInputOption=None, insertDataOption=None, body=None):
+        def run():
+            values = body['values']
+            with self._lock:
+                start = len(self.rows) + 1
+                self.rows.extend(values)
+            return {'updates': {'updatedRange': f"Sheet1!A{start}:I{start + len(values) - 1}"}}
+        return _Request(self.faults, 'sheets.append', run)
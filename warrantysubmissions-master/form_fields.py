@@ -0,0 +1,107 @@
+import re
+from datetime import datetime
+
+EMAIL_PATTERN = re.compile(r'[^@\s]+@[^@\s]+\.[a-z]{2,}')
+
+# Day-first formats, as used by the Danish and German storefronts
+DATE_FORMATS = ('%Y-%m-%d', '%d.%m.%Y', '%d-%m-%Y', '%d/%m/%Y', '%d.%m.%y', '%d/%m/%y')
+
+def normalize_text(value):
+    """Collapse runs of whitespace."""
+    return ' '.join(value.split())
+
+def normalize_email(value):
+    """Lowercase an email address, dropping any mailto: prefix."""
+    value = value.strip().lower()
+    if value.startswith('mailto:'):
+        value = value[len('mailto:'):]
+    return value if EMAIL_PATTERN.fullmatch(value) else None
+
+def normalize_phone(value):
+    """Keep only digits and a leading +."""
+    digits = re.sub(r'\D', '', value)
+    if len(digits) < 6:
+        return None
+    return f"+{digits}" if value.strip().startswith('+') else digits
+
+def normalize_date(value):
+    """Convert common day-first date formats to YYYY-MM-DD."""
+    value = value.strip()
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, date_format).strftime('%Y-%m-%d')
+        except ValueError:
+            continue
+    return value
+
+# Sheet column key, labels seen in submission emails, normalizer
+FIELD_SCHEMA = [
+    ('customer_name', ('Name', 'Full name', 'Customer name', 'Navn', 'Fulde navn'), normalize_text),
+    ('email', ('Email', 'E-mail', 'Email address', 'E-mail adresse', 'Mail'), normalize_email),
+    ('phone', ('Phone', 'Phone number', 'Telephone', 'Telefon', 'Telefonnummer', 'Tlf', 'Mobil'), normalize_phone),
+    ('address', ('Address', 'Adresse', 'Street address'), normalize_text),
+    ('product_model', ('Product', 'Product model', 'Model', 'Produkt', 'Produktmodel'), normalize_text),
+    ('serial_number', ('Serial number', 'Serial', 'Serial no', 'Serienummer'), normalize_text),
+    ('purchase_date', ('Purchase date', 'Date of purchase', 'Købsdato', 'Kaufdatum'), normalize_date)
+]
+
+class FieldMatcher:
+    """A field schema compiled into one regular expression.
+
+    Every label of every field is a branch of a single alternation, so each
+    line of the email is tested once no matter how many fields there are.
+    A value follows the label after a colon, or sits on the next line when
+    the label stands alone (as in two-column tables).
+    """
+
+    def __init__(self, schema):
+        self.keys = [key for key, _, _ in schema]
+        self.normalizers = {key: normalizer for key, _, normalizer in schema}
+        self.label_keys = {}
+        for key, labels, _ in schema:
+            for label in labels:
+                self.label_keys[label.lower()] = key
+
+        # Longest labels first so "Phone number" wins over "Phone"
+        labels = sorted(self.label_keys, key=len, reverse=True)
+        alternation = '|'.join(re.escape(label) for label in labels)
+        self.pattern = re.compile(
+            rf'(?P<label>{alternation})\s*(?::\s*(?P<value>.*))?',
+            re.IGNORECASE
+        )
+
+    def extract(self, lines):
+        """Return (fields, missing) from the email's text lines in one pass."""
+        fields = {}
+        lines = [line.strip() for line in lines]
+        lines = [line for line in lines if line]
+
+        for index, line in enumerate(lines):
+            match = self.pattern.fullmatch(line)
+            if not match:
+                continue
+
+            key = self.label_keys[match.group('label').lower()]
+            if key in fields:
+                continue
+
+            value = match.group('value')
+            if not value and index + 1 < len(lines):
+                # A following label means this field was left empty
+                if not self.pattern.fullmatch(lines[index + 1]):
+                    value = lines[index + 1]
+            if not value:
+                continue
+
+            normalized = self.normalizers[key](value)
+            if normalized:
+                fields[key] = normalized
+
+        missing = [key for key in self.keys if key not in fields]
+        return fields, missing
+
+_default_matcher = FieldMatcher(FIELD_SCHEMA)
+
+def extract_form_fields(lines, matcher=None):
+    """Extract warranty form fields from text lines using the default schema."""
+    return (matcher or _default_matcher).extract(lines)
@@ -0,0 +1,135 @@
+import os
+import shutil
+import time
+from datetime import datetime, timedelta, timezone
+
+# Drive appProperties holding a file's expiry; index.js writes retentionDate
+# on folders and cleanup.js reads gdprExpiryDate, so both are honoured
+EXPIRY_PROPERTIES = ('gdprExpiryDate', 'retentionDate')
+
+def get_retention_days():
+    """Return how many days submission data is kept (five years by default)."""
+    return int(os.getenv('GDPR_RETENTION_DAYS', str(5 * 365 + 1)))
+
+def gdpr_expiry_date(now=None):
+    """Return the ISO expiry timestamp for data stored now."""
+    now = now or datetime.now(timezone.utc)
+    return (now + timedelta(days=get_retention_days())).isoformat()
+
+def parse_expiry(value):
+    """Parse an ISO expiry timestamp, treating naive ones as UTC."""
+    expiry = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if expiry.tzinfo is None:
+        expiry = expiry.replace(tzinfo=timezone.utc)
+    return expiry
+
+def iter_cleanup_folders(drive_service, folder_id, now):
+    """Yield the Drive folder and each of its YYYY/MM shards that may hold expired files.
+
+    Files expire a retention period after they are uploaded, so a month
+    shard that began less than a retention period ago is skipped without
+    listing its files.
+    """
+    from drive_folders import list_folders
+
+    yield folder_id
+
+    cutoff = now - timedelta(days=get_retention_days())
+    for year in list_folders(drive_service, folder_id):
+        if not year['name'].isdigit():
+            continue
+        for month in list_folders(drive_service, year['id']):
+            try:
+                started = datetime(int(year['name']), int(month['name']), 1, tzinfo=timezone.utc)
+            except ValueError:
+                continue
+            if started <= cutoff:
+                yield month['id']
+
+def cleanup_drive(drive_service, folder_id, dry_run=False):
+    """Delete files in the Drive folder and its month shards whose expiry date has passed.
+
+    Returns the number of files deleted (or that would be, with dry_run).
+    """
+    now = datetime.now(timezone.utc)
+    return sum(
+        _cleanup_folder(drive_service, shard_id, now, dry_run)
+        for shard_id in iter_cleanup_folders(drive_service, folder_id, now)
+    )
+
+def _cleanup_folder(drive_service, folder_id, now, dry_run):
+    """Delete the expired files directly inside one Drive folder.
+
+    Deleted files are dropped from the upload index too, so resubmitted
+    content is uploaded again instead of linking to the deleted file.
+    """
+    from rate_limiter import execute_with_quota
+    from pdf_store import get_upload_index
+
+    deleted = 0
+    page_token = None
+    while True:
+        response = execute_with_quota(
+            drive_service.files().list(
+                q=f"'{folder_id}' in parents and trashed = false",
+                fields='nextPageToken, files(id, name, appProperties)',
+                spaces='drive',
+                pageSize=1000,
+                pageToken=page_token
+            ),
+            'drive',
+            'files.list'
+        )
+
+        for file in response.get('files', []):
+            properties = file.get('appProperties') or {}
+            expiry = next((properties[key] for key in EXPIRY_PROPERTIES if key in properties), None)
+            if not expiry:
+                continue
+            try:
+                expired = now > parse_expiry(expiry)
+            except ValueError:
+                print(f"Skipping {file['name']} with unreadable expiry {expiry}")
+                continue
+            if not expired:
+                continue
+
+            print(f"Deleting expired file: {file['name']}")
+            if not dry_run:
+                execute_with_quota(drive_service.files().delete(fileId=file['id']), 'drive', 'files.delete')
+                get_upload_index().forget_file(file['id'])
+            deleted += 1
+
+        page_token = response.get('nextPageToken')
+        if not page_token:
+            return deleted
+
+def cleanup_local_pdfs(root="downloaded_pdfs", max_age_days=None, dry_run=False):
+    """Delete local PDF copies older than the retention period.
+
+    Returns the number of stored PDFs removed.
+    """
+    max_age_days = max_age_days if max_age_days is not None else get_retention_days()
+    if not os.path.isdir(root):
+        return 0
+
+    cutoff = time.time() - max_age_days * 24 * 60 * 60
+    removed = 0
+    for entry in os.scandir(root):
+        # The store keeps each PDF in a directory named after its digest
+        if entry.is_dir() and entry.stat().st_mtime < cutoff:
+            print(f"Deleting expired local copy: {entry.path}")
+            if not dry_run:
+                shutil.rmtree(entry.path, ignore_errors=True)
+            removed += 1
+    return removed
+
+def cleanup_ledger(dry_run=False):
+    """Delete ledger records older than the retention period.
+
+    Returns the number of records removed.
+    """
+    from ledger import get_ledger
+
+    cutoff = time.time() - get_retention_days() * 24 * 60 * 60
+    return get_ledger().delete_older_than(cutoff, dry_run=dry_run)
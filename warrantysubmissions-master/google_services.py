@@ -0,0 +1,110 @@
+import os
+import pickle
+import threading
+from datetime import datetime, timedelta
+import httplib2
+import google_auth_httplib2
+from googleapiclient.discovery import build
+
+# Every API the processor talks to shares one token
+SCOPES = [
+    'https://www.googleapis.com/auth/gmail.readonly',
+    'https://www.googleapis.com/auth/spreadsheets',
+    'https://www.googleapis.com/auth/drive.file'
+]
+
+API_VERSIONS = {
+    'gmail': 'v1',
+    'sheets': 'v4',
+    'drive': 'v3'
+}
+
+TOKEN_PATH = 'token.pickle'
+
+# Refresh a little before expiry so in-flight calls never see a stale token
+REFRESH_MARGIN = timedelta(minutes=5)
+
+_credentials = None
+_credentials_lock = threading.Lock()
+_local = threading.local()
+
+def _load_credentials():
+    """Load saved credentials or run the OAuth flow."""
+    creds = None
+
+    # Load existing credentials if available
+    if os.path.exists(TOKEN_PATH):
+        with open(TOKEN_PATH, 'rb') as token:
+            creds = pickle.load(token)
+
+    # Tokens saved by the old per-script flows lack Gmail, Sheets or Drive
+    if creds and creds.refresh_token and creds.has_scopes(SCOPES):
+        return creds
+    if creds and creds.refresh_token:
+        print(f"Saved token in {TOKEN_PATH} does not cover all required scopes, re-authorizing")
+
+    # The OAuth flow is only needed the first time, so import it on demand
+    from google_auth_oauthlib.flow import InstalledAppFlow
+
+    flow = InstalledAppFlow.from_client_config({
+        "installed": {
+            "client_id": os.getenv('GOOGLE_CLIENT_ID'),
+            "client_secret": os.getenv('GOOGLE_CLIENT_SECRET'),
+            "redirect_uris": [os.getenv('GOOGLE_REDIRECT_URI')],
+            "auth_uri": "https://accounts.google.com/o/oauth2/auth",
+            "token_uri": "https://oauth2.googleapis.com/token"
+        }
+    }, SCOPES)
+    creds = flow.run_local_server(port=0)
+    _save_credentials(creds)
+    return creds
+
+def _save_credentials(creds):
+    """Save credentials for future runs without leaving a torn file behind."""
+    temp_path = f"{TOKEN_PATH}.tmp"
+    with open(temp_path, 'wb') as token:
+        pickle.dump(creds, token)
+    os.replace(temp_path, TOKEN_PATH)
+
+def _needs_refresh(creds):
+    """Check whether credentials are expired or about to expire."""
+    if not creds.token or not creds.expiry:
+        return True
+    return datetime.utcnow() + REFRESH_MARGIN >= creds.expiry
+
+def get_credentials():
+    """Return shared credentials, loading and refreshing them at most once at a time."""
+    global _credentials
+    with _credentials_lock:
+        if _credentials is None:
+            _credentials = _load_credentials()
+
+        if _needs_refresh(_credentials):
+            # Refresh over httplib2 like every API call, so requests is never imported for it
+            _credentials.refresh(google_auth_httplib2.Request(httplib2.Http()))
+            _save_credentials(_credentials)
+
+        return _credentials
+
+def get_service(api):
+    """Return a cached API client for the calling thread.
+
+    Clients are built once per thread from the bundled static discovery
+    documents, since httplib2 connections must not be shared across threads.
+    """
+    creds = get_credentials()
+
+    services = getattr(_local, 'services', None)
+    if services is None:
+        services = _local.services = {}
+
+    if api not in services:
+        http = google_auth_httplib2.AuthorizedHttp(creds, http=httplib2.Http())
+        services[api] = build(
+            api,
+            API_VERSIONS[api],
+            http=http,
+            cache_discovery=False,
+            static_discovery=True
+        )
+    return services[api]
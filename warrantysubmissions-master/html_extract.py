@@ -0,0 +1,191 @@
+import os
+from html.parser import HTMLParser
+from form_fields import extract_form_fields
+from metrics import instrument
+
+try:
+    import lxml.html
+except ImportError:
+    lxml = None
+
+class _StopParsing(Exception):
+    """Raised to abandon the parse once the PDF link is found."""
+
+class _PdfLinkParser(HTMLParser):
+    """Streaming parser that stops at the first <a> whose text ends in .pdf."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.href = None
+        self._anchor_href = None
+        self._anchor_text = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'a':
+            self._anchor_href = dict(attrs).get('href')
+            self._anchor_text = []
+
+    def handle_data(self, data):
+        if self._anchor_text is not None:
+            self._anchor_text.append(data)
+
+    def handle_endtag(self, tag):
+        if tag != 'a' or self._anchor_text is None:
+            return
+        text = ''.join(self._anchor_text)
+        self._anchor_text = None
+        if text.endswith('.pdf'):
+            self.href = self._anchor_href
+            raise _StopParsing()
+
+class _TextParser(HTMLParser):
+    """Collect the text nodes of a document without building a tree."""
+
+    SKIPPED_TAGS = {'script', 'style', 'head', 'title'}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.lines = []
+        self._skipping = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIPPED_TAGS:
+            self._skipping += 1
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIPPED_TAGS and self._skipping:
+            self._skipping -= 1
+
+    def handle_data(self, data):
+        if not self._skipping and data.strip():
+            self.lines.append(data.strip())
+
+def find_pdf_href_stream(html_content):
+    """Find the PDF link without building a tree, stopping at the first match."""
+    # Most emails without a PDF can be rejected without parsing at all
+    if '.pdf' not in html_content:
+        return None
+
+    parser = _PdfLinkParser()
+    try:
+        parser.feed(html_content)
+        parser.close()
+    except _StopParsing:
+        pass
+    return parser.href
+
+def find_pdf_href_lxml(html_content):
+    """Find the PDF link with lxml's C parser."""
+    if '.pdf' not in html_content:
+        return None
+
+    root = lxml.html.fromstring(html_content)
+    for anchor in root.iter('a'):
+        if anchor.text_content().endswith('.pdf'):
+            return anchor.get('href')
+    return None
+
+def find_pdf_href_soup(soup):
+    """Find the PDF link in an already parsed BeautifulSoup tree."""
+    pdf_link = soup.find('a', text=lambda t: t and t.endswith('.pdf'))
+    if pdf_link:
+        return pdf_link.get('href')
+    return None
+
+EXTRACTORS = {
+    'stream': find_pdf_href_stream,
+    'lxml': find_pdf_href_lxml
+}
+
+def get_extractor_name():
+    """Return the configured fast-path extractor, falling back when lxml is missing."""
+    name = os.getenv('HTML_EXTRACTOR', 'stream')
+    if name == 'lxml' and lxml is None:
+        return 'stream'
+    return name
+
+class ParsedEmail:
+    """One warranty email's HTML, parsed at most once however often it is read.
+
+    The PDF link comes from the configured fast path and only falls back to
+    a full BeautifulSoup parse when that fails or HTML_EXTRACTOR=soup. The
+    soup itself is built lazily and shared by everything that needs the tree.
+    """
+
+    def __init__(self, html_content, extractor=None):
+        self.html = html_content
+        self.extractor = extractor or get_extractor_name()
+        self._soup = None
+        self._text_lines = None
+        self._form_fields = None
+        self._pdf_href = None
+        self._pdf_href_done = False
+
+    @property
+    def soup(self):
+        """The full BeautifulSoup tree, built on first use."""
+        if self._soup is None:
+            # bs4 is slow to import and only needed on the fallback path
+            from bs4 import BeautifulSoup
+            self._soup = BeautifulSoup(self.html, 'html.parser')
+        return self._soup
+
+    @property
+    def text_lines(self):
+        """The non-empty text nodes of the email, in document order."""
+        if self._text_lines is None:
+            parser = _TextParser()
+            parser.feed(self.html)
+            parser.close()
+            self._text_lines = parser.lines
+        return self._text_lines
+
+    @property
+    def form_fields(self):
+        """The (fields, missing) pair extracted from the form's text."""
+        if self._form_fields is None:
+            self._form_fields = extract_form_fields(self.text_lines)
+        return self._form_fields
+
+    @property
+    def pdf_href(self):
+        """The href of the first anchor whose text ends in .pdf, or None."""
+        if not self._pdf_href_done:
+            self._pdf_href = self._find_pdf_href()
+            self._pdf_href_done = True
+        return self._pdf_href
+
+    @instrument('extract_pdf_url_from_html')
+    def _find_pdf_href(self):
+        """Run the configured extractor over the HTML, falling back to BeautifulSoup."""
+        fast_path = EXTRACTORS.get(self.extractor)
+        if fast_path:
+            try:
+                return fast_path(self.html)
+            except Exception as e:
+                print(f"Fast HTML extraction failed, falling back to BeautifulSoup: {e}")
+        return find_pdf_href_soup(self.soup)
+
+class ExtractedEmail:
+    """The results of parsing an email elsewhere, without its HTML.
+
+    Offers the same pdf_href and form_fields as ParsedEmail, so a parse
+    done in a worker process can travel back as a few hundred bytes.
+    """
+
+    __slots__ = ('pdf_href', 'form_fields')
+
+    def __init__(self, pdf_href, form_fields):
+        self.pdf_href = pdf_href
+        self.form_fields = form_fields
+
+def extract_email(html_content):
+    """Parse email HTML into an ExtractedEmail."""
+    parsed = ParsedEmail(html_content)
+    return ExtractedEmail(parsed.pdf_href, parsed.form_fields)
+
+def as_parsed_email(html_content):
+    """Wrap raw HTML in a ParsedEmail, passing parsed or extracted emails through."""
+    if isinstance(html_content, (ParsedEmail, ExtractedEmail)):
+        return html_content
+    return ParsedEmail(html_content)
@@ -0,0 +1,82 @@
+import os
+import threading
+
+# Statuses the CDN returns when it wants us to slow down or try again
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+_session = None
+_session_lock = threading.Lock()
+
+def get_session_settings():
+    """Read HTTP connection pool settings from the environment."""
+    return {
+        'pool_hosts': int(os.getenv('HTTP_POOL_HOSTS', '4')),
+        'pool_maxsize': int(os.getenv('HTTP_POOL_MAXSIZE', '8')),
+        'retries': int(os.getenv('HTTP_RETRIES', '3')),
+        'backoff_factor': float(os.getenv('HTTP_BACKOFF_FACTOR', '0.5'))
+    }
+
+def create_http_session(pool_hosts=4, pool_maxsize=8, retries=3, backoff_factor=0.5):
+    """Create a requests session with a tuned connection pool and retries.
+
+    pool_hosts is the number of per-host pools kept alive, and pool_maxsize
+    caps the connections open to any one host. Callers block rather than
+    open extra connections once a host's pool is exhausted.
+    """
+    # Imported here so get_pool_stats stays cheap for runs that download nothing
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    retry = Retry(
+        total=retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=frozenset(['GET', 'HEAD']),
+        respect_retry_after_header=True
+    )
+    adapter = HTTPAdapter(
+        pool_connections=pool_hosts,
+        pool_maxsize=pool_maxsize,
+        pool_block=True,
+        max_retries=retry
+    )
+
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+def get_http_session():
+    """Return the process-wide session shared by all download threads."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = create_http_session(**get_session_settings())
+    return _session
+
+def get_pool_stats():
+    """Return connection reuse stats per host for the shared session.
+
+    A hit is a request served on an already open connection; a miss is a
+    request that had to open a new one.
+    """
+    stats = {}
+    if _session is None:
+        return stats
+
+    adapters = {id(adapter): adapter for adapter in _session.adapters.values()}
+    for adapter in adapters.values():
+        pools = adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            host = f"{pool.scheme}://{pool.host}:{pool.port}"
+            stats[host] = {
+                'requests': pool.num_requests,
+                'hits': pool.num_requests - pool.num_connections,
+                'misses': pool.num_connections
+            }
+    return stats
@@ -1,168 +1,627 @@
 import os
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.transport.requests import Request
-from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
 from dotenv import load_dotenv
-import pickle
 import base64
-from download_warranty_pdf import process_warranty_email
-from datetime import datetime
+from email import policy
+from email.parser import BytesParser
+import time
+from itertools import islice, chain
+from ledger import get_ledger
+from metrics import instrument, record_retry, write_metrics_report, MessageTimer
+from sheets_writer import SheetsBatchWriter, get_writer_settings
+from http_session import get_pool_stats
+from google_services import get_service
+from sync_checkpoint import load_checkpoint, save_checkpoint
+from rate_limiter import (
+    execute_with_quota,
+    get_rate_limiter,
+    get_limiter_stats,
+    quota_cost,
+    is_rate_limit_error,
+    backoff_delay
+)
 
 # Load environment variables
 load_dotenv()
 
-# Gmail API setup
-SCOPES = [
-    'https://www.googleapis.com/auth/gmail.readonly',
-    'https://www.googleapis.com/auth/spreadsheets'
-]
+# The processing modules pull in the HTML parsers, the PDF downloader and the
+# Drive upload code. They are imported inside the functions that use them so
+# a run that finds no new mail never pays for them.
+
+# Gmail batch endpoint accepts at most 100 sub-requests per call
+GMAIL_BATCH_SIZE = 100
+
+# Sub-request failures worth retrying; anything else is permanent
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
 
 def get_google_services():
-    """Get or create Google API services."""
-    creds = None
-    
-    # Load existing credentials if available
-    if os.path.exists('token.pickle'):
-        with open('token.pickle', 'rb') as token:
-            creds = pickle.load(token)
-    
-    # Refresh/create credentials if needed
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
-        else:
-            flow = InstalledAppFlow.from_client_config({
-                "installed": {
-                    "client_id": os.getenv('GOOGLE_CLIENT_ID'),
-                    "client_secret": os.getenv('GOOGLE_CLIENT_SECRET'),
-                    "redirect_uris": [os.getenv('GOOGLE_REDIRECT_URI')],
-                    "auth_uri": "https://accounts.google.com/o/oauth2/auth",
-                    "token_uri": "https://oauth2.googleapis.com/token"
-                }
-            }, SCOPES)
-            creds = flow.run_local_server(port=0)
-        
-        # Save credentials for future use
-        with open('token.pickle', 'wb') as token:
-            pickle.dump(creds, token)
-    
-    # Build both services
-    gmail_service = build('gmail', 'v1', credentials=creds)
-    sheets_service = build('sheets', 'v4', credentials=creds)
-    
-    return gmail_service, sheets_service
-
-def append_to_sheets(sheets_service, data):
-    """Append warranty submission data to Google Sheets."""
-    try:
-        spreadsheet_id = os.getenv('GOOGLE_SHEET_ID')
-        range_name = 'Sheet1!A:Z'  # Adjust based on your sheet's structure
-        
-        # Prepare the row data
-        row = [
-            datetime.now().strftime('%Y-%m-%d %H:%M:%S'),  # Timestamp
-            data.get('customer_name', ''),
-            data.get('email', ''),
-            data.get('phone', ''),
-            data.get('address', ''),
-            data.get('product_model', ''),
-            data.get('serial_number', ''),
-            data.get('purchase_date', ''),
-            data.get('pdf_url', '')  # This will be the Drive link to the PDF
-        ]
-        
-        body = {
-            'values': [row]
-        }
-        
-        result = sheets_service.spreadsheets().values().append(
-            spreadsheetId=spreadsheet_id,
-            range=range_name,
-            valueInputOption='RAW',
-            insertDataOption='INSERT_ROWS',
-            body=body
-        ).execute()
-        
-        print(f"Successfully appended data to Google Sheets: {result}")
-        return True
+    """Get cached Gmail and Sheets API services."""
+    return get_service('gmail'), get_service('sheets')
+
+def create_sheets_writer(sheets_service, ledger=None):
+    """Create a batching Sheets writer that marks written rows in the ledger."""
+    def on_written(message_id, sheet_row):
+        if ledger:
+            ledger.record(message_id, 'appended', sheet_row=sheet_row)
+        print(f"Successfully processed email {message_id} and updated sheets")
     
-    except Exception as e:
-        print(f"Error appending to Google Sheets: {e}")
-        return False
+    def on_failed(message_id, error):
+        print(f"Failed to update sheets for email {message_id}")
+        if ledger:
+            ledger.record_failure(message_id, error, 'append')
+    
+    return SheetsBatchWriter(
+        sheets_service,
+        on_written=on_written,
+        on_failed=on_failed,
+        **get_writer_settings()
+    )
 
-def get_warranty_emails(service):
-    """Fetch warranty form submission emails."""
+@instrument('get_warranty_emails')
+def get_warranty_emails(service, page_size=None, window=None, raise_errors=False):
+    """Yield warranty form submission message IDs, one result page at a time.
+    
+    window is a Gmail search clause limiting the time range; it defaults to
+    the last RETENTION_PERIOD days. A listing error ends the listing early,
+    or is raised with raise_errors, for callers that must not mistake a
+    partial listing for a complete one.
+    """
     query = os.getenv('GMAIL_SEARCH_QUERY')
     retention_days = int(os.getenv('RETENTION_PERIOD', '5'))
+    if window is None:
+        window = f"newer_than:{retention_days}d"
     
-    try:
-        results = service.users().messages().list(
-            userId='me',
-            q=f"{query} newer_than:{retention_days}d"
-        ).execute()
+    # Gmail caps maxResults at 500 per page
+    if page_size is None:
+        page_size = int(os.getenv('GMAIL_PAGE_SIZE', '500'))
+    page_size = max(1, min(page_size, 500))
+    
+    page_token = None
+    while True:
+        try:
+            results = execute_with_quota(
+                service.users().messages().list(
+                    userId='me',
+                    q=f"{query} {window}",
+                    maxResults=page_size,
+                    pageToken=page_token
+                ),
+                'gmail',
+                'messages.list'
+            )
+        except Exception as e:
+            if raise_errors:
+                raise
+            print(f"Error fetching emails: {e}")
+            return
         
-        messages = results.get('messages', [])
-        return messages
-    except Exception as e:
-        print(f"Error fetching emails: {e}")
-        return []
+        for message in results.get('messages', []):
+            yield message['id']
+        
+        # Follow the next page until the listing is exhausted
+        page_token = results.get('nextPageToken')
+        if not page_token:
+            return
 
-def process_email(gmail_service, sheets_service, message_id):
-    """Process a single email and download its PDF."""
-    try:
-        # Get the email content
-        message = gmail_service.users().messages().get(
-            userId='me',
-            id=message_id,
-            format='full'
-        ).execute()
+@instrument('fetch_messages')
+def fetch_messages(gmail_service, message_ids, max_retries=3):
+    """Fetch full messages through the Gmail batch endpoint.
+    
+    Returns a dict of message ID to message resource. Only the sub-requests
+    that failed with a retryable error are sent again. Every sub-request is
+    charged against the Gmail quota, and rate-limited ones slow it down.
+    """
+    messages = {}
+    pending = list(message_ids)
+    limiter = get_rate_limiter('gmail')
+    
+    for attempt in range(max_retries + 1):
+        failed = []
+        rate_limited = []
+        
+        def callback(request_id, response, exception):
+            if exception is None:
+                messages[request_id] = response
+            elif is_rate_limit_error(exception):
+                rate_limited.append(request_id)
+                failed.append(request_id)
+            elif isinstance(exception, HttpError) and exception.resp.status not in RETRYABLE_STATUSES:
+                print(f"Error fetching email {request_id}: {exception}")
+            else:
+                failed.append(request_id)
+        
+        batch = gmail_service.new_batch_http_request(callback=callback)
+        for message_id in pending:
+            batch.add(
+                gmail_service.users().messages().get(
+                    userId='me',
+                    id=message_id,
+                    **get_fetch_params()
+                ),
+                request_id=message_id
+            )
+        
+        limiter.acquire(quota_cost('gmail', 'messages.get') * len(pending))
+        try:
+            batch.execute()
+        except Exception as e:
+            if is_rate_limit_error(e):
+                rate_limited.append(None)
+            # The whole batch failed, so retry everything not yet fetched
+            print(f"Error executing Gmail batch: {e}")
+            failed = [message_id for message_id in pending if message_id not in messages]
         
+        if rate_limited:
+            limiter.rate_limited()
+        else:
+            limiter.succeeded()
+        
+        if not failed:
+            break
+        
+        pending = failed
+        record_retry('fetch_messages', len(failed))
+        if attempt < max_retries:
+            time.sleep(backoff_delay(attempt))
+    else:
+        for message_id in pending:
+            print(f"Giving up on email {message_id} after {max_retries} retries")
+    
+    return messages
+
+def get_fetch_params():
+    """Return the messages.get format and partial-response fields to request.
+    
+    'raw' (the default) fetches only the RFC 822 source and parses it locally;
+    'full' fetches only the payload tree instead of the whole resource.
+    """
+    if os.getenv('GMAIL_FETCH_FORMAT', 'raw') == 'full':
+        return {'format': 'full', 'fields': 'id,payload'}
+    return {'format': 'raw', 'fields': 'id,raw'}
+
+def decode_base64url(data):
+    """Decode Gmail's base64url data, tolerating missing padding."""
+    if isinstance(data, str):
+        data = data.encode('ascii')
+    return base64.urlsafe_b64decode(data + b'=' * (-len(data) % 4))
+
+def find_html_part(part):
+    """Depth-first search of a Gmail payload tree for the text/html part."""
+    if part.get('mimeType') == 'text/html' and part.get('body', {}).get('data'):
+        return part
+    for child in part.get('parts', []):
+        found = find_html_part(child)
+        if found:
+            return found
+    return None
+
+def get_html_body(message):
+    """Return the decoded HTML body of a Gmail message, or None.
+    
+    Handles both raw messages and payload trees, including HTML nested inside
+    multipart/alternative within multipart/mixed.
+    """
+    if 'raw' in message:
+        mime_message = BytesParser(policy=policy.default).parsebytes(decode_base64url(message['raw']))
+        html_part = mime_message.get_body(preferencelist=('html',))
+        if html_part is None:
+            return None
+        try:
+            return html_part.get_content()
+        except LookupError:
+            # Unknown or bogus charset
+            return html_part.get_payload(decode=True).decode('utf-8', errors='replace')
+    
+    if 'payload' in message:
+        html_part = find_html_part(message['payload'])
+        if html_part:
+            charset = 'utf-8'
+            for header in html_part.get('headers', []):
+                if header['name'].lower() == 'content-type' and 'charset=' in header['value']:
+                    charset = header['value'].split('charset=')[-1].split(';')[0].strip('"\' ')
+            try:
+                return decode_base64url(html_part['body']['data']).decode(charset, errors='replace')
+            except LookupError:
+                return decode_base64url(html_part['body']['data']).decode('utf-8', errors='replace')
+    return None
+
+@instrument('process_email', message_arg=1)
+def handle_message(sheets_writer, message_id, message, ledger=None):
+    """Process an already fetched email and download its PDF.
+    
+    With a ledger, the email resumes from the last stage it completed.
+    """
+    from concurrent_processing import download_stage, upload_stage, StageError
+    from html_extract import ParsedEmail
+    
+    try:
         # Get email body
-        if 'payload' in message and 'parts' in message['payload']:
-            for part in message['payload']['parts']:
-                if part['mimeType'] == 'text/html':
-                    body = base64.urlsafe_b64decode(
-                        part['body']['data'].encode('UTF-8')
-                    ).decode('utf-8')
-                    
-                    # Process the warranty email and download PDF
-                    result = process_warranty_email(body)
-                    if result:
-                        # Append data to Google Sheets
-                        if append_to_sheets(sheets_service, result):
-                            print(f"Successfully processed email {message_id} and updated sheets")
-                        else:
-                            print(f"Failed to update sheets for email {message_id}")
-                    else:
-                        print(f"Failed to process email {message_id}")
-                    
-                    return result
-        
-        print(f"No HTML content found in email {message_id}")
-        return None
+        body = get_html_body(message)
+        if body is None:
+            print(f"No HTML content found in email {message_id}")
+            if ledger:
+                ledger.record_failure(message_id, "No HTML content found", 'parse')
+            return None
+        body = ParsedEmail(body)
+        
+        # Download the PDF and upload it to Drive
+        try:
+            local_pdf = download_stage(message_id, body, ledger)
+            result = upload_stage(message_id, body, local_pdf, ledger)
+        except StageError as e:
+            print(f"Failed to process email {message_id} at {e.stage}: {e}")
+            if ledger:
+                ledger.record_failure(message_id, e)
+            return None
+        
+        # Queue the row for Google Sheets
+        sheets_writer.add(message_id, result)
+        return result
     
     except Exception as e:
         print(f"Error processing email {message_id}: {e}")
+        if ledger:
+            ledger.record_failure(message_id, e, 'process')
         return None
 
-def main():
-    """Main function to process warranty emails."""
-    # Get Google services
-    gmail_service, sheets_service = get_google_services()
+def chunked(iterable, size):
+    """Yield lists of up to size items from iterable."""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+class HistoryExpired(Exception):
+    """The stored historyId is too old for users.history.list."""
+
+def list_history_additions(service, start_history_id):
+    """Return (added message IDs, latest historyId) since start_history_id."""
+    added = []
+    seen = set()
+    page_token = None
+    while True:
+        try:
+            results = execute_with_quota(
+                service.users().history().list(
+                    userId='me',
+                    startHistoryId=start_history_id,
+                    historyTypes=['messageAdded'],
+                    maxResults=500,
+                    pageToken=page_token
+                ),
+                'gmail',
+                'history.list'
+            )
+        except HttpError as e:
+            if e.resp.status == 404:
+                raise HistoryExpired(start_history_id) from e
+            raise
+        
+        for record in results.get('history', []):
+            for added_message in record.get('messagesAdded', []):
+                message_id = added_message['message']['id']
+                if message_id not in seen:
+                    seen.add(message_id)
+                    added.append(message_id)
+        
+        page_token = results.get('nextPageToken')
+        if not page_token:
+            return added, results.get('historyId', start_history_id)
+
+def get_current_history_id(service):
+    """Return the mailbox's current historyId."""
+    return execute_with_quota(service.users().getProfile(userId='me'), 'gmail', 'getProfile')['historyId']
+
+def get_incremental_message_ids(service, checkpoint=None):
+    """Return (message IDs to process, historyId to checkpoint afterwards).
+    
+    With a valid checkpoint only messages added since then are listed, and
+    those are narrowed to warranty submissions with one search. Without one,
+    or when the checkpoint has expired, the full retention window is scanned.
+    Listing errors are raised rather than yielding a partial list, since the
+    checkpoint would otherwise move past mail that was never seen.
+    """
+    if checkpoint:
+        try:
+            added, history_id = list_history_additions(service, checkpoint['history_id'])
+            if not added:
+                return [], history_id
+            
+            # Keep only added messages matching the warranty search query,
+            # looking back an hour before the last listing to absorb clock skew
+            since = int(checkpoint.get('listed_at') or checkpoint.get('synced_at', 0)) - 3600
+            added = set(added)
+            matching = [
+                message_id
+                for message_id in get_warranty_emails(service, window=f"after:{since}", raise_errors=True)
+                if message_id in added
+            ]
+            return matching, history_id
+        except HistoryExpired:
+            print("Sync checkpoint expired, falling back to a full scan")
+    
+    # Record the position before scanning so nothing added meanwhile is missed
+    history_id = get_current_history_id(service)
+    return list(get_warranty_emails(service, raise_errors=True)), history_id
+
+def add_failed_messages(message_ids, ledger):
+    """Append messages that failed within the retention period to an incremental listing.
+    
+    History only reports a message once, so without this a failed download
+    or upload would never be retried the way the retention-window scan does.
+    Emails with no HTML body or no PDF link are not retried.
+    """
+    retention_days = int(os.getenv('RETENTION_PERIOD', '5'))
+    listed = set(message_ids)
+    failed = [
+        message_id
+        for message_id in ledger.failed_since(time.time() - retention_days * 24 * 60 * 60)
+        if message_id not in listed
+    ]
+    if failed:
+        print(f"Retrying {len(failed)} previously failed warranty emails")
+    return list(message_ids) + failed
+
+def iter_email_bodies(gmail_service, message_ids, batch_size, ledger=None):
+    """Yield (message_id, html_body) for every listed warranty email.
+    
+    With a ledger, emails that were already appended to the sheet are skipped
+    before they are fetched. With PARSE_PROCESSES set, each fetched batch is
+    parsed on the worker processes instead.
+    """
+    from html_extract import ParsedEmail
+    from parse_pool import get_parse_pool
+    
+    parse_pool = get_parse_pool()
+    for batch_ids in chunked(message_ids, batch_size):
+        if ledger:
+            batch_ids = ledger.filter_unprocessed(batch_ids)
+            if not batch_ids:
+                continue
+        messages = fetch_messages(gmail_service, batch_ids)
+        if parse_pool:
+            fetched = [(message_id, messages[message_id]) for message_id in batch_ids if message_id in messages]
+            for message_id, extracted in parse_pool.iter_extracted(fetched):
+                if isinstance(extracted, Exception):
+                    print(extracted)
+                    if ledger:
+                        ledger.record_failure(message_id, extracted)
+                    continue
+                yield message_id, extracted
+            continue
+        
+        for message_id in batch_ids:
+            if message_id not in messages:
+                if ledger:
+                    ledger.record_failure(message_id, f"Could not fetch email {message_id}", 'fetch')
+                continue
+            try:
+                body = get_html_body(messages[message_id])
+            except Exception as e:
+                # One undecodable email must not end the listing
+                print(f"Could not parse email {message_id}: {e}")
+                if ledger:
+                    ledger.record_failure(message_id, f"Could not parse email {message_id}: {e}", 'parse')
+                continue
+            if body is None:
+                print(f"No HTML content found in email {message_id}")
+                if ledger:
+                    ledger.record_failure(message_id, "No HTML content found", 'parse')
+                continue
+            yield message_id, ParsedEmail(body)
+
+def iter_unprocessed(message_ids, batch_size, ledger=None):
+    """Yield (message_id, None) for listed emails the ledger has not finished."""
+    for batch_ids in chunked(message_ids, batch_size):
+        if ledger:
+            batch_ids = ledger.filter_unprocessed(batch_ids)
+        for message_id in batch_ids:
+            yield message_id, None
+
+@instrument('parse_message', message_arg=0)
+def parse_message(message_id, message):
+    """Decode an email's HTML body and run both parsers over it up front."""
+    from concurrent_processing import StageError
+    from html_extract import ParsedEmail
+    
+    body = get_html_body(message)
+    if body is None:
+        raise StageError('parse', f"No HTML content found in email {message_id}")
+    
+    # Do the parsing work here rather than in the I/O stages
+    parsed = ParsedEmail(body)
+    parsed.pdf_href
+    parsed.form_fields
+    return parsed
+
+def build_pipeline(batch_size, ledger=None):
+    """Build the fetch -> parse -> download -> upload pipeline.
+    
+    Listing feeds the pipeline and the sheet writer consumes its reports, so
+    together they cover the whole flow. Each stage's worker count is read
+    from PIPELINE_<STAGE>_WORKERS. With PARSE_PROCESSES set, the parse stage
+    hands chunks of messages to worker processes instead.
+    """
+    from concurrent_processing import download_stage, upload_stage, StageError
+    from pipeline import Pipeline, Stage, get_stage_workers
+    from parse_pool import get_parse_pool
+    
+    def fetch(message_ids, _):
+        # Worker threads need their own Gmail client
+        messages = fetch_messages(get_service('gmail'), message_ids)
+        return [
+            messages[message_id] if message_id in messages
+            else StageError('fetch', f"Could not fetch email {message_id}")
+            for message_id in message_ids
+        ]
+    
+    def download(message_id, parsed):
+        return parsed, download_stage(message_id, parsed, ledger)
     
-    # Get warranty emails
-    emails = get_warranty_emails(gmail_service)
+    def upload(message_id, downloaded):
+        parsed, local_pdf = downloaded
+        return upload_stage(message_id, parsed, local_pdf, ledger)
     
-    if not emails:
-        print("No warranty form emails found")
+    parse_pool = get_parse_pool()
+    if parse_pool:
+        # Each thread waits on one chunk, so every process has one to work on
+        parse = Stage('parse', parse_pool.extract, workers=parse_pool.processes, batch_size=parse_pool.chunk_size)
+    else:
+        parse = Stage('parse', parse_message, workers=get_stage_workers('parse', 1))
+    
+    return Pipeline(
+        [
+            Stage('fetch', fetch, workers=get_stage_workers('fetch', 2), batch_size=batch_size),
+            parse,
+            Stage('download', download, workers=get_stage_workers('download', 4)),
+            Stage('upload', upload, workers=get_stage_workers('upload', 2))
+        ],
+        queue_size=int(os.getenv('PIPELINE_QUEUE_SIZE', '32')),
+        max_in_flight=int(os.getenv('PIPELINE_MAX_IN_FLIGHT', '256'))
+    )
+
+def report_result(sheets_writer, report, ledger=None):
+    """Queue a finished message for Google Sheets and print its outcome."""
+    message_id = report['message_id']
+    if report['status'] != 'ok':
+        print(f"Failed to process email {message_id} at {report['stage']}: {report['error']}")
+        if ledger:
+            ledger.record_failure(message_id, report['error'], report['stage'])
         return
     
-    print(f"Found {len(emails)} warranty form emails")
+    sheets_writer.add(message_id, report['result'])
+
+def print_pool_stats():
+    """Print how often PDF downloads reused pooled connections and API quota use."""
+    for host, stats in get_pool_stats().items():
+        print(f"Connection pool {host}: {stats['requests']} requests, "
+              f"{stats['hits']} reused, {stats['misses']} new connections")
+    for api, stats in get_limiter_stats().items():
+        print(f"Rate limiter {api}: {stats['calls']} calls, {stats['throttled']} rate limited, "
+              f"{stats['waited']:.1f}s waited, now {stats['rate']:.1f} units/s")
+
+def get_batch_size():
+    """Read the Gmail batch size, capped at what the batch endpoint accepts."""
+    return min(int(os.getenv('GMAIL_BATCH_SIZE', str(GMAIL_BATCH_SIZE))), GMAIL_BATCH_SIZE)
+
+def process_message_ids(gmail_service, sheets_service, message_ids, ledger):
+    """Process message IDs in the configured PROCESSING_MODE; return how many were handled.
+    
+    Each message is timed as the process_email operation: by handle_message
+    in sequential mode, and from queueing to its report in the others.
+    """
+    batch_size = get_batch_size()
+    processing_mode = os.getenv('PROCESSING_MODE', 'sequential')
+    timer = MessageTimer('process_email')
     
-    # Process each email
-    for email in emails:
-        process_email(gmail_service, sheets_service, email['id'])
+    def on_result(report):
+        timer.finish(report)
+        report_result(sheets_writer, report, ledger)
+    
+    with create_sheets_writer(sheets_service, ledger) as sheets_writer:
+        if processing_mode == 'pipeline':
+            # Every stage runs on its own workers with bounded queues between them
+            reports = build_pipeline(batch_size, ledger).run(
+                timer.track(iter_unprocessed(message_ids, batch_size, ledger)),
+                on_result
+            )
+            return len(reports)
+        
+        if processing_mode == 'async':
+            # One event loop with per-service concurrency limits
+            from async_runner import AsyncRunner
+            runner = AsyncRunner(
+                lambda batch_ids: fetch_messages(get_service('gmail'), batch_ids),
+                parse_message,
+                ledger=ledger,
+                batch_size=batch_size
+            )
+            reports = runner.run(timer.track(message_ids), on_result)
+            return len(reports)
+        
+        if processing_mode == 'concurrent':
+            # Download and upload in parallel, appending rows in message order
+            from concurrent_processing import process_concurrently, get_worker_settings
+            reports = process_concurrently(
+                timer.track(iter_email_bodies(gmail_service, message_ids, batch_size, ledger)),
+                on_result,
+                ledger=ledger,
+                **get_worker_settings()
+            )
+            return len(reports)
+        
+        # Fetch warranty emails in batches as each result page arrives
+        count = 0
+        for batch_ids in chunked(message_ids, batch_size):
+            # Skip emails that already made it into the sheet
+            batch_ids = ledger.filter_unprocessed(batch_ids)
+            if not batch_ids:
+                continue
+            
+            messages = fetch_messages(gmail_service, batch_ids)
+            for message_id in batch_ids:
+                if message_id in messages:
+                    handle_message(sheets_writer, message_id, messages[message_id], ledger)
+                else:
+                    ledger.record_failure(message_id, f"Could not fetch email {message_id}", 'fetch')
+            count += len(batch_ids)
+        return count
+
+def sync_once(gmail_service, sheets_service, ledger, incremental=False, window=None):
+    """List and process warranty emails once; return how many were handled.
+    
+    With incremental set, only mail added since the sync checkpoint is
+    listed, together with messages that failed within the retention period,
+    and the checkpoint is advanced once everything is processed. A listing
+    error is raised and leaves the checkpoint where it was. Otherwise the
+    given search window (default: the retention period) is scanned.
+    sheets_service may be None; it is only built when there is mail to
+    process.
+    """
+    history_id = None
+    if incremental:
+        listed_at = time.time()
+        message_ids, history_id = get_incremental_message_ids(gmail_service, load_checkpoint())
+        message_ids = add_failed_messages(message_ids, ledger)
+    else:
+        # Peek at the lazy listing, since a generator is never falsy
+        message_ids = get_warranty_emails(gmail_service, window=window)
+        first = next(message_ids, None)
+        message_ids = chain([first], message_ids) if first is not None else []
+    
+    count = 0
+    # An empty incremental listing needs neither Sheets nor the processors
+    if message_ids:
+        count = process_message_ids(gmail_service, sheets_service or get_service('sheets'), message_ids, ledger)
+    
+    if history_id:
+        save_checkpoint(history_id, listed_at)
+    return count
+
+def run_sync(incremental=False, window=None):
+    """Run one sync and print its outcome; return how many emails were handled."""
+    # Sheets is only built once there is mail to process
+    gmail_service = get_service('gmail')
+    ledger = get_ledger()
+    
+    count = sync_once(gmail_service, None, ledger, incremental, window)
+    
+    if not count:
+        print("No new warranty form emails found")
+        write_metrics_report()
+        return count
+    
+    print(f"Processed {count} warranty form emails")
+    print_pool_stats()
+    write_metrics_report()
+    return count
+
+def main():
+    """Main function to process warranty emails."""
+    # Only look at new mail when incremental sync is enabled
+    run_sync(incremental=os.getenv('INCREMENTAL_SYNC', 'false').lower() == 'true')
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
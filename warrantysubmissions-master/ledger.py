@@ -0,0 +1,214 @@
+import os
+import json
+import sqlite3
+import threading
+import time
+
+# Stages a message moves through, in order
+STAGES = ('downloaded', 'uploaded', 'appended')
+
+# Stage of a message that failed before reaching any of STAGES
+FAILED = 'failed'
+
+# Failures that retrying the same email cannot fix: no HTML body, no PDF link
+PERMANENT_FAILURE_STAGES = ('parse', 'resolve')
+
+# Stay well below SQLite's bound-parameter limit in IN (...) lookups
+MAX_LOOKUP_IDS = 500
+
+_ledger = None
+_ledger_lock = threading.Lock()
+
+class Ledger:
+    """SQLite record of how far each Gmail message got through processing."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS messages (
+                    message_id TEXT PRIMARY KEY,
+                    stage TEXT NOT NULL,
+                    pdf_path TEXT,
+                    drive_link TEXT,
+                    row_data TEXT,
+                    sheet_row TEXT,
+                    error TEXT,
+                    updated_at REAL NOT NULL,
+                    failed_stage TEXT,
+                    failed_at REAL
+                )
+            ''')
+            # Ledgers created before failures were tracked lack these columns
+            columns = {row['name'] for row in self._conn.execute('PRAGMA table_info(messages)')}
+            for column, kind in (('failed_stage', 'TEXT'), ('failed_at', 'REAL')):
+                if column not in columns:
+                    self._conn.execute(f'ALTER TABLE messages ADD COLUMN {column} {kind}')
+
+    def get_many(self, message_ids):
+        """Return a dict of message ID to ledger record for the known IDs."""
+        records = {}
+        message_ids = list(message_ids)
+        for start in range(0, len(message_ids), MAX_LOOKUP_IDS):
+            chunk = message_ids[start:start + MAX_LOOKUP_IDS]
+            placeholders = ','.join('?' * len(chunk))
+            with self._lock:
+                rows = self._conn.execute(
+                    f'SELECT * FROM messages WHERE message_id IN ({placeholders})',
+                    chunk
+                ).fetchall()
+            for row in rows:
+                records[row['message_id']] = self._to_record(row)
+        return records
+
+    def get(self, message_id):
+        """Return the ledger record for one message, or None."""
+        return self.get_many([message_id]).get(message_id)
+
+    def filter_unprocessed(self, message_ids):
+        """Return the IDs, in order, that have not been appended to the sheet yet."""
+        message_ids = list(message_ids)
+        records = self.get_many(message_ids)
+        return [
+            message_id
+            for message_id in message_ids
+            if records.get(message_id, {}).get('stage') != 'appended'
+        ]
+
+    def filter_unfinished(self, message_ids):
+        """Return the IDs, in order, that are neither in the sheet nor permanently failed."""
+        message_ids = list(message_ids)
+        records = self.get_many(message_ids)
+        return [
+            message_id
+            for message_id in message_ids
+            if records.get(message_id, {}).get('stage') != 'appended'
+            and records.get(message_id, {}).get('failed_stage') not in PERMANENT_FAILURE_STAGES
+        ]
+
+    def record(self, message_id, stage, **fields):
+        """Advance a message to stage, storing any extra fields given.
+
+        row_data holds the customer's details only until the row is in the
+        sheet; reaching 'appended' clears it.
+        """
+        if stage not in STAGES:
+            raise ValueError(f"Unknown ledger stage: {stage}")
+
+        row_data = fields.get('row_data') if stage != 'appended' else None
+        values = {
+            'pdf_path': fields.get('pdf_path'),
+            'drive_link': fields.get('drive_link'),
+            'row_data': json.dumps(row_data) if row_data is not None else None,
+            'sheet_row': fields.get('sheet_row')
+        }
+        with self._lock, self._conn:
+            self._conn.execute('''
+                INSERT INTO messages (message_id, stage, pdf_path, drive_link, row_data, sheet_row, error, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, NULL, ?)
+                ON CONFLICT(message_id) DO UPDATE SET
+                    stage = excluded.stage,
+                    pdf_path = COALESCE(excluded.pdf_path, pdf_path),
+                    drive_link = COALESCE(excluded.drive_link, drive_link),
+                    row_data = CASE WHEN excluded.stage = 'appended' THEN NULL
+                                    ELSE COALESCE(excluded.row_data, row_data) END,
+                    sheet_row = COALESCE(excluded.sheet_row, sheet_row),
+                    error = NULL,
+                    failed_stage = NULL,
+                    failed_at = NULL,
+                    updated_at = excluded.updated_at
+            ''', (
+                message_id, stage, values['pdf_path'], values['drive_link'],
+                values['row_data'], values['sheet_row'], time.time()
+            ))
+
+    def record_failure(self, message_id, error, stage=None):
+        """Remember why and at which stage a message failed.
+
+        A message that already reached a stage keeps it; one that failed
+        before its first stage gets a FAILED row, so every failure is on
+        record. failed_at keeps the time of the first failure in a row.
+        """
+        stage = stage or getattr(error, 'stage', None)
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute('''
+                INSERT INTO messages (message_id, stage, error, updated_at, failed_stage, failed_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT(message_id) DO UPDATE SET
+                    error = excluded.error,
+                    failed_stage = excluded.failed_stage,
+                    failed_at = COALESCE(failed_at, excluded.failed_at),
+                    updated_at = excluded.updated_at
+            ''', (message_id, FAILED, str(error), now, stage, now))
+
+    def failed_since(self, since):
+        """Return the IDs of unfinished messages that first failed after since, oldest first.
+
+        Permanent failures are left out, since fetching them again cannot help.
+        """
+        placeholders = ','.join('?' * len(PERMANENT_FAILURE_STAGES))
+        with self._lock:
+            rows = self._conn.execute(
+                f'''SELECT message_id FROM messages
+                    WHERE error IS NOT NULL AND stage != 'appended' AND failed_at >= ?
+                    AND (failed_stage IS NULL OR failed_stage NOT IN ({placeholders}))
+                    ORDER BY failed_at''',
+                (since, *PERMANENT_FAILURE_STAGES)
+            ).fetchall()
+        return [row['message_id'] for row in rows]
+
+    def delete_older_than(self, cutoff, dry_run=False):
+        """Delete messages last updated before cutoff; return how many there were.
+
+        Also clears row_data left on appended messages by older versions,
+        so no customer details outlive the sheet row they were copied to.
+        """
+        with self._lock, self._conn:
+            count = self._conn.execute(
+                'SELECT COUNT(*) FROM messages WHERE updated_at < ?', (cutoff,)
+            ).fetchone()[0]
+            if not dry_run:
+                self._conn.execute('DELETE FROM messages WHERE updated_at < ?', (cutoff,))
+                self._conn.execute(
+                    "UPDATE messages SET row_data = NULL WHERE stage = 'appended' AND row_data IS NOT NULL"
+                )
+        return count
+
+    def stats(self):
+        """Return the number of messages at each stage."""
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT stage, COUNT(*) AS count FROM messages GROUP BY stage'
+            ).fetchall()
+        return {row['stage']: row['count'] for row in rows}
+
+    def close(self):
+        """Close the underlying database connection."""
+        with self._lock:
+            self._conn.close()
+
+    @staticmethod
+    def _to_record(row):
+        """Convert a database row into a plain record dict."""
+        record = dict(row)
+        if record['row_data']:
+            record['row_data'] = json.loads(record['row_data'])
+        return record
+
+def get_ledger_path():
+    """Return where the ledger is stored (LEDGER_PATH)."""
+    return os.getenv('LEDGER_PATH', 'ledger.db')
+
+def get_ledger():
+    """Return the process-wide ledger stored at LEDGER_PATH."""
+    global _ledger
+    if _ledger is None:
+        with _ledger_lock:
+            if _ledger is None:
+                _ledger = Ledger(get_ledger_path())
+    return _ledger
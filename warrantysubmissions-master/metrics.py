@@ -0,0 +1,351 @@
+import os
+import json
+import time
+import threading
+import functools
+import inspect
+import contextvars
+
+# Latency buckets in seconds, from a parsed email up to a slow Drive upload
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+PREFIX = 'warranty'
+
+_UNSET = object()
+_registry = _UNSET
+_registry_lock = threading.Lock()
+
+# Message ID the current thread or task is working on, for trace spans
+_current_message = contextvars.ContextVar('current_message', default=None)
+
+class Histogram:
+    """Cumulative-bucket latency histogram."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                break
+        else:
+            index = len(self.buckets)
+        self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """Estimate a quantile as the upper bound of the bucket it falls in."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return self.buckets[index] if index < len(self.buckets) else float('inf')
+        return float('inf')
+
+class MetricsRegistry:
+    """Histograms, counters and trace spans collected during a run."""
+
+    def __init__(self, trace_path=None):
+        self.histograms = {}
+        self.counters = {}
+        self.trace_path = trace_path
+        self.spans = 0
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self._trace_file = open(trace_path, 'a') if trace_path else None
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+    def count(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def span(self, operation, start, duration, outcome, message_id=None, error=None):
+        """Record one finished operation as a structured trace span."""
+        with self._lock:
+            self.spans += 1
+            if not self._trace_file:
+                return
+            span = {
+                'message_id': message_id,
+                'operation': operation,
+                'start': round(start, 6),
+                'duration': round(duration, 6),
+                'outcome': outcome,
+                'thread': threading.current_thread().name
+            }
+            if error:
+                span['error'] = error
+            self._trace_file.write(json.dumps(span) + '\n')
+
+    def close(self):
+        with self._lock:
+            if self._trace_file:
+                self._trace_file.close()
+                self._trace_file = None
+
+    def to_openmetrics(self):
+        """Render every metric in the OpenMetrics text format."""
+        lines = []
+        with self._lock:
+            histograms = sorted(self.histograms.items())
+            counters = sorted(self.counters.items())
+
+        families = {}
+        for (name, labels), histogram in histograms:
+            families.setdefault(name, []).append((labels, histogram))
+        for name, series in families.items():
+            metric = f"{PREFIX}_{name}_seconds"
+            lines.append(f"# TYPE {metric} histogram")
+            lines.append(f"# UNIT {metric} seconds")
+            for labels, histogram in series:
+                cumulative = 0
+                for bound, count in zip([float(bound) for bound in histogram.buckets] + ['+Inf'], histogram.counts):
+                    cumulative += count
+                    lines.append(f"{metric}_bucket{_format_labels(labels, le=bound)} {cumulative}")
+                lines.append(f"{metric}_count{_format_labels(labels)} {histogram.count}")
+                lines.append(f"{metric}_sum{_format_labels(labels)} {histogram.sum:.6f}")
+
+        families = {}
+        for (name, labels), value in counters:
+            families.setdefault(name, []).append((labels, value))
+        for name, series in families.items():
+            metric = f"{PREFIX}_{name}"
+            lines.append(f"# TYPE {metric} counter")
+            for labels, value in series:
+                lines.append(f"{metric}_total{_format_labels(labels)} {value}")
+
+        lines.append('# EOF')
+        return '\n'.join(lines) + '\n'
+
+    def summary(self):
+        """Return a JSON-friendly summary of the run."""
+        with self._lock:
+            histograms = list(self.histograms.items())
+            counters = list(self.counters.items())
+
+        operations = {}
+        for (name, labels), histogram in histograms:
+            operations[_summary_key(name, labels)] = {
+                'count': histogram.count,
+                'mean': histogram.sum / histogram.count if histogram.count else None,
+                'p50': histogram.quantile(0.5),
+                'p90': histogram.quantile(0.9),
+                'p99': histogram.quantile(0.99)
+            }
+        totals = {}
+        for (name, labels), value in counters:
+            totals[_summary_key(name, labels)] = value
+
+        return {
+            'started': self.started,
+            'elapsed': time.time() - self.started,
+            'latency': operations,
+            'counters': totals,
+            'spans': self.spans
+        }
+
+def _format_labels(labels, **extra):
+    """Render label pairs as {key="value",...}, escaping as OpenMetrics requires."""
+    pairs = list(labels) + list(extra.items())
+    if not pairs:
+        return ''
+    escaped = []
+    for key, value in pairs:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        escaped.append(f'{key}="{value}"')
+    return '{' + ','.join(escaped) + '}'
+
+def _summary_key(name, labels):
+    """Join a metric name and its label values, e.g. operations.download_pdf.ok."""
+    return '.'.join([name] + [str(label_value) for _, label_value in labels])
+
+def get_registry():
+    """Return the process-wide registry, or None when METRICS_ENABLED is off."""
+    global _registry
+    if _registry is _UNSET:
+        with _registry_lock:
+            if _registry is _UNSET:
+                if os.getenv('METRICS_ENABLED', 'false').lower() == 'true':
+                    _registry = MetricsRegistry(os.getenv('METRICS_TRACE_PATH') or None)
+                else:
+                    _registry = None
+    return _registry
+
+def count(name, value=1, **labels):
+    """Add to a counter when metrics are enabled."""
+    registry = get_registry()
+    if registry is not None and value:
+        registry.count(name, value, **labels)
+
+def record_bytes(direction, size):
+    """Count bytes downloaded from the CDN or uploaded to Drive."""
+    count('bytes', size, direction=direction)
+
+def record_retry(operation, attempts=1):
+    """Count retried calls of an operation."""
+    count('retries', attempts, operation=operation)
+
+class MessageTimer:
+    """Time each message of a run from when it is queued to its final report.
+
+    For processing modes where a message crosses threads and stages, so no
+    single call covers it. Records the same histogram, counter and span as
+    instrument() does.
+    """
+
+    def __init__(self, operation):
+        self.operation = operation
+        self.enabled = get_registry() is not None
+        self._started = {}
+        self._lock = threading.Lock()
+
+    def track(self, items):
+        """Pass message IDs or (message_id, value) pairs through, noting when each was queued."""
+        for item in items:
+            if self.enabled:
+                message_id = item[0] if isinstance(item, tuple) else item
+                with self._lock:
+                    self._started[message_id] = (time.perf_counter(), time.time())
+            yield item
+
+    def finish(self, report):
+        """Record a message's outcome from its pipeline report."""
+        if not self.enabled:
+            return
+        with self._lock:
+            started = self._started.pop(report['message_id'], None)
+        if started is None:
+            return
+
+        start, wall_start = started
+        outcome = 'ok' if report['status'] == 'ok' else 'failure'
+        _finish(get_registry(), self.operation, start, wall_start, outcome, report['error'], report['message_id'])
+
+def record_operation(operation, wall_start, duration, outcome, message_id=None, error=None):
+    """Record one call of an operation timed elsewhere, e.g. in a worker process."""
+    registry = get_registry()
+    if registry is not None:
+        _record(registry, operation, wall_start, duration, outcome, message_id, error)
+
+def _record(registry, operation, wall_start, duration, outcome, message_id=None, error=None):
+    registry.observe('operation_duration', duration, operation=operation)
+    registry.count('operations', operation=operation, outcome=outcome)
+    registry.span(operation, wall_start, duration, outcome, message_id or _current_message.get(), error)
+
+def _finish(registry, operation, start, wall_start, outcome, error=None, message_id=None):
+    _record(registry, operation, wall_start, time.perf_counter() - start, outcome, message_id, error)
+
+def instrument(operation, message_arg=None):
+    """Time a function, count its outcomes and trace it per message.
+
+    A call fails when it raises or, following this codebase's convention,
+    returns None or False. With message_arg, that positional argument is
+    the message ID the call (and every call it makes) is traced under.
+    Generator functions are timed from first item to exhaustion, and
+    coroutine functions until they return. When metrics are disabled the
+    only cost is one registry check per call.
+    """
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                registry = get_registry()
+                if registry is None:
+                    return await func(*args, **kwargs)
+
+                token = _current_message.set(args[message_arg]) if message_arg is not None else None
+                start, wall_start = time.perf_counter(), time.time()
+                try:
+                    result = await func(*args, **kwargs)
+                except Exception as e:
+                    _finish(registry, operation, start, wall_start, 'error', str(e))
+                    raise
+                else:
+                    outcome = 'failure' if result is None or result is False else 'ok'
+                    _finish(registry, operation, start, wall_start, outcome)
+                    return result
+                finally:
+                    if token is not None:
+                        _current_message.reset(token)
+            return wrapper
+
+        if inspect.isgeneratorfunction(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                registry = get_registry()
+                if registry is None:
+                    return func(*args, **kwargs)
+                return _traced_generator(registry, operation, func(*args, **kwargs))
+            return wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            registry = get_registry()
+            if registry is None:
+                return func(*args, **kwargs)
+
+            token = _current_message.set(args[message_arg]) if message_arg is not None else None
+            start, wall_start = time.perf_counter(), time.time()
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                _finish(registry, operation, start, wall_start, 'error', str(e))
+                raise
+            else:
+                outcome = 'failure' if result is None or result is False else 'ok'
+                _finish(registry, operation, start, wall_start, outcome)
+                return result
+            finally:
+                if token is not None:
+                    _current_message.reset(token)
+        return wrapper
+    return decorator
+
+def _traced_generator(registry, operation, generator):
+    start, wall_start = time.perf_counter(), time.time()
+    items = 0
+    try:
+        for item in generator:
+            items += 1
+            yield item
+    except Exception as e:
+        _finish(registry, operation, start, wall_start, 'error', str(e))
+        raise
+    _finish(registry, operation, start, wall_start, 'ok' if items else 'empty')
+    registry.count('items', items, operation=operation)
+
+def write_metrics_report():
+    """Write the OpenMetrics text and JSON summary files at the end of a run.
+
+    Returns the summary, or None when metrics are disabled.
+    """
+    registry = get_registry()
+    if registry is None:
+        return None
+
+    summary = registry.summary()
+    openmetrics_path = os.getenv('METRICS_OPENMETRICS_PATH', 'metrics.prom')
+    json_path = os.getenv('METRICS_JSON_PATH', 'metrics.json')
+    for path, content in ((openmetrics_path, registry.to_openmetrics()), (json_path, json.dumps(summary, indent=2))):
+        temp_path = f"{path}.tmp"
+        with open(temp_path, 'w') as f:
+            f.write(content)
+        os.replace(temp_path, path)
+
+    print(f"Metrics written to {openmetrics_path} and {json_path}")
+    return summary
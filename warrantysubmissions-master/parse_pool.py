@@ -0,0 +1,109 @@
+import os
+import time
+import atexit
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from metrics import record_operation
+
+_parse_pool = None
+_parse_pool_lock = threading.Lock()
+
+def get_parse_settings():
+    """Read the parse process count and chunk size from the environment."""
+    return {
+        'processes': int(os.getenv('PARSE_PROCESSES', '0')),
+        'chunk_size': int(os.getenv('PARSE_CHUNK_SIZE', '16'))
+    }
+
+def _init_worker():
+    """Worker process setup: leave metrics to the parent, which owns the registry."""
+    os.environ['METRICS_ENABLED'] = 'false'
+
+def _extract_chunk(chunk):
+    """Worker process: decode and parse a chunk of (message_id, message) pairs.
+
+    Returns (message_id, ExtractedEmail, error, wall_start, duration)
+    tuples, where error is a message string when the email could not be
+    parsed and the times are for the parent's parse_message metric.
+    """
+    # Imported here so the parent never pays for them twice
+    from index import get_html_body
+    from html_extract import extract_email
+
+    results = []
+    for message_id, message in chunk:
+        start, wall_start = time.perf_counter(), time.time()
+        extracted, error = None, None
+        try:
+            body = get_html_body(message)
+            if body is None:
+                error = f"No HTML content found in email {message_id}"
+            else:
+                extracted = extract_email(body)
+        except Exception as e:
+            error = f"Could not parse email {message_id}: {e}"
+        results.append((message_id, extracted, error, wall_start, time.perf_counter() - start))
+    return results
+
+def _to_outcome(message_id, extracted, error, wall_start, duration):
+    """Record a worker's parse timing and turn its result into an ExtractedEmail or StageError."""
+    from concurrent_processing import StageError
+
+    record_operation('parse_message', wall_start, duration, 'failure' if error else 'ok', message_id, error)
+    return extracted if error is None else StageError('parse', error)
+
+class ParsePool:
+    """Parse warranty emails on a pool of worker processes.
+
+    HTML parsing is CPU-bound and holds the GIL, so threads cannot spread
+    it across cores. Messages are sent to the workers in chunks, still in
+    their raw Gmail form so MIME decoding happens there too, and only the
+    PDF link and form fields come back. Downloads and uploads stay on the
+    parent's threads.
+    """
+
+    def __init__(self, processes, chunk_size=16):
+        self.processes = processes
+        self.chunk_size = max(1, chunk_size)
+        # Forking a process that is already running worker threads can copy
+        # held locks into the child, so workers start from a fresh interpreter
+        self._executor = ProcessPoolExecutor(
+            max_workers=processes,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker
+        )
+
+    def extract(self, message_ids, messages):
+        """Parse one chunk; return an ExtractedEmail or StageError per message."""
+        results = self._executor.submit(_extract_chunk, list(zip(message_ids, messages))).result()
+        return [_to_outcome(*result) for result in results]
+
+    def iter_extracted(self, emails):
+        """Parse (message_id, message) pairs, yielding (message_id, ExtractedEmail or StageError) in order.
+
+        Every chunk is submitted up front, so all workers stay busy while
+        the results are consumed.
+        """
+        emails = list(emails)
+        chunks = [emails[start:start + self.chunk_size] for start in range(0, len(emails), self.chunk_size)]
+        for results in self._executor.map(_extract_chunk, chunks):
+            for result in results:
+                yield result[0], _to_outcome(*result)
+
+    def close(self):
+        """Stop the worker processes."""
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+def get_parse_pool():
+    """Return the process-wide parse pool, or None when PARSE_PROCESSES is 0."""
+    global _parse_pool
+    settings = get_parse_settings()
+    if settings['processes'] <= 0:
+        return None
+    if _parse_pool is None:
+        with _parse_pool_lock:
+            if _parse_pool is None:
+                _parse_pool = ParsePool(settings['processes'], settings['chunk_size'])
+                atexit.register(_parse_pool.close)
+    return _parse_pool
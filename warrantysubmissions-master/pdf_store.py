@@ -0,0 +1,186 @@
+import os
+import re
+import hashlib
+import sqlite3
+import threading
+import time
+
+# Stored PDFs live at <root>/<sha256>/<original filename>
+DIGEST_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+
+# Drive expires resumable sessions after a week; stay safely inside that
+SESSION_MAX_AGE = 6 * 24 * 60 * 60
+
+_upload_index = None
+_upload_index_lock = threading.Lock()
+
+def store_pdf(temp_path, root, digest, filename):
+    """Move a fully written temp file into the content-addressed store.
+
+    If the same content is already stored, the temp file is discarded and
+    the existing copy is returned, so a resubmitted invoice keeps its first
+    filename and is never written twice.
+    """
+    digest_dir = os.path.join(root, digest)
+    os.makedirs(digest_dir, exist_ok=True)
+
+    existing = [name for name in os.listdir(digest_dir) if not name.endswith('.part')]
+    if existing:
+        os.remove(temp_path)
+        return os.path.join(digest_dir, existing[0])
+
+    output_path = os.path.join(digest_dir, filename)
+    os.replace(temp_path, output_path)
+    return output_path
+
+def file_digest(file_path, chunk_size=64 * 1024):
+    """Return the SHA-256 of a file, read from its store path when possible."""
+    parent = os.path.basename(os.path.dirname(os.path.abspath(file_path)))
+    if DIGEST_PATTERN.match(parent):
+        return parent
+
+    sha256 = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+class UploadIndex:
+    """SQLite index of which PDF contents are already in Drive."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS drive_uploads (
+                    sha256 TEXT PRIMARY KEY,
+                    drive_file_id TEXT NOT NULL,
+                    web_view_link TEXT NOT NULL,
+                    uploaded_at REAL NOT NULL
+                )
+            ''')
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS upload_sessions (
+                    sha256 TEXT PRIMARY KEY,
+                    uri TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    started_at REAL NOT NULL
+                )
+            ''')
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS drive_folders (
+                    parent_id TEXT NOT NULL,
+                    name TEXT NOT NULL,
+                    folder_id TEXT NOT NULL,
+                    PRIMARY KEY (parent_id, name)
+                )
+            ''')
+
+    def get(self, digest):
+        """Return the Drive upload for this content, or None."""
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT * FROM drive_uploads WHERE sha256 = ?', (digest,)
+            ).fetchone()
+        return dict(row) if row else None
+
+    def record(self, digest, drive_file_id, web_view_link):
+        """Remember that this content was uploaded to Drive."""
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO drive_uploads VALUES (?, ?, ?, ?)',
+                (digest, drive_file_id, web_view_link, time.time())
+            )
+
+    def forget_file(self, drive_file_id):
+        """Forget an upload whose Drive file was deleted, so its content is uploaded again."""
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM drive_uploads WHERE drive_file_id = ?', (drive_file_id,))
+
+    def get_session(self, digest):
+        """Return a saved resumable upload session for this content, or None.
+
+        Drive keeps resumable sessions for a week, so older ones are ignored.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT * FROM upload_sessions WHERE sha256 = ? AND started_at > ?',
+                (digest, time.time() - SESSION_MAX_AGE)
+            ).fetchone()
+        return dict(row) if row else None
+
+    def save_session(self, digest, uri, size):
+        """Remember a resumable upload session so a later run can continue it."""
+        with self._lock, self._conn:
+            self._conn.execute(
+                '''INSERT INTO upload_sessions VALUES (?, ?, ?, ?)
+                   ON CONFLICT(sha256) DO UPDATE SET
+                       uri = excluded.uri, size = excluded.size, started_at = excluded.started_at
+                   WHERE uri != excluded.uri''',
+                (digest, uri, size, time.time())
+            )
+
+    def clear_session(self, digest):
+        """Forget the resumable session of a finished upload."""
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM upload_sessions WHERE sha256 = ?', (digest,))
+
+    def get_folder(self, parent_id, name):
+        """Return the cached ID of a Drive folder by parent and name, or None."""
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT folder_id FROM drive_folders WHERE parent_id = ? AND name = ?', (parent_id, name)
+            ).fetchone()
+        return row[0] if row else None
+
+    def record_folder(self, parent_id, name, folder_id):
+        """Cache the ID of a Drive folder."""
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO drive_folders VALUES (?, ?, ?)',
+                (parent_id, name, folder_id)
+            )
+
+    def clear_folders(self):
+        """Forget every cached folder, e.g. after one was deleted in Drive."""
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM drive_folders')
+
+    def stats(self):
+        """Return the number of uploaded contents, open upload sessions and cached folders."""
+        with self._lock:
+            uploads = self._conn.execute('SELECT COUNT(*) FROM drive_uploads').fetchone()[0]
+            sessions = self._conn.execute('SELECT COUNT(*) FROM upload_sessions').fetchone()[0]
+            folders = self._conn.execute('SELECT COUNT(*) FROM drive_folders').fetchone()[0]
+        return {'uploads': uploads, 'sessions': sessions, 'folders': folders}
+
+    def clear_expired_sessions(self):
+        """Forget resumable sessions Drive has already expired; return how many."""
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                'DELETE FROM upload_sessions WHERE started_at <= ?',
+                (time.time() - SESSION_MAX_AGE,)
+            )
+        return cursor.rowcount
+
+    def close(self):
+        """Close the underlying database connection."""
+        with self._lock:
+            self._conn.close()
+
+def get_upload_index_path():
+    """Return where the upload index is stored (PDF_INDEX_PATH)."""
+    return os.getenv('PDF_INDEX_PATH', 'pdf_index.db')
+
+def get_upload_index():
+    """Return the process-wide upload index stored at PDF_INDEX_PATH."""
+    global _upload_index
+    if _upload_index is None:
+        with _upload_index_lock:
+            if _upload_index is None:
+                _upload_index = UploadIndex(get_upload_index_path())
+    return _upload_index
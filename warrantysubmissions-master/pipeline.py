@@ -0,0 +1,190 @@
+import os
+import queue
+import threading
+
+# Marks the end of a stage's input; each worker consumes exactly one
+_END = object()
+
+class Stage:
+    """One step of a pipeline, run by its own pool of worker threads.
+
+    func(key, value) returns the value handed to the next stage, or raises to
+    fail that item. With batch_size > 1, func(keys, values) instead receives
+    up to batch_size items at once and returns one result per item, where an
+    exception instance fails just that item.
+    """
+
+    def __init__(self, name, func, workers=1, batch_size=1, batch_wait=0.05):
+        self.name = name
+        self.func = func
+        self.workers = max(1, workers)
+        self.batch_size = max(1, batch_size)
+        self.batch_wait = batch_wait
+
+def make_report(key, outcome):
+    """Turn a finished item (a result or an exception) into a result report."""
+    if isinstance(outcome, Exception):
+        return {
+            'message_id': key,
+            'status': 'failed',
+            'stage': getattr(outcome, 'stage', 'unknown'),
+            'result': None,
+            'error': str(outcome)
+        }
+    return {
+        'message_id': key,
+        'status': 'ok',
+        'stage': 'done',
+        'result': outcome,
+        'error': None
+    }
+
+def get_stage_workers(name, default):
+    """Read a stage's worker count from PIPELINE_<NAME>_WORKERS."""
+    return int(os.getenv(f"PIPELINE_{name.upper()}_WORKERS", str(default)))
+
+class Pipeline:
+    """Run items through stages connected by bounded queues.
+
+    Each pair of stages is joined by a queue of at most queue_size items, so a
+    slow stage applies backpressure instead of letting work pile up, while
+    faster stages keep running ahead until their output queue fills. Once the
+    input is exhausted every stage drains its queue and shuts down in turn.
+    At most max_in_flight items are inside the pipeline at once.
+    """
+
+    def __init__(self, stages, queue_size=16, max_in_flight=64):
+        self.stages = stages
+        self.queue_size = queue_size
+        self.max_in_flight = max_in_flight
+
+    def run(self, items, on_result=None):
+        """Process (key, value) pairs and return one report per item.
+
+        Reports are passed to on_result from the calling thread in the order
+        the items were given, however the stages interleave. If reading the
+        input raises, the items already read are finished and the error is
+        then raised here, so the caller never mistakes a cut-short input for
+        a complete one.
+        """
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in self.stages]
+        results = queue.Queue()
+        in_flight = threading.BoundedSemaphore(self.max_in_flight)
+        feed_error = []
+
+        def feed():
+            try:
+                for seq, (key, value) in enumerate(items):
+                    in_flight.acquire()
+                    queues[0].put((seq, key, value))
+            except Exception as e:
+                print(f"Error reading pipeline input: {e}")
+                feed_error.append(e)
+            finally:
+                for _ in range(self.stages[0].workers):
+                    queues[0].put(_END)
+
+        threads = [threading.Thread(target=feed, name='pipeline-source', daemon=True)]
+        for index, stage in enumerate(self.stages):
+            next_queue = queues[index + 1] if index + 1 < len(self.stages) else results
+            next_workers = self.stages[index + 1].workers if index + 1 < len(self.stages) else 1
+            remaining = [stage.workers]
+            remaining_lock = threading.Lock()
+
+            def finished(next_queue=next_queue, next_workers=next_workers,
+                         remaining=remaining, remaining_lock=remaining_lock):
+                # The last worker out closes the next stage's input
+                with remaining_lock:
+                    remaining[0] -= 1
+                    last = remaining[0] == 0
+                if last:
+                    for _ in range(next_workers):
+                        next_queue.put(_END)
+
+            for number in range(stage.workers):
+                threads.append(threading.Thread(
+                    target=self._work,
+                    args=(stage, queues[index], next_queue, results, finished),
+                    name=f"pipeline-{stage.name}-{number}",
+                    daemon=True
+                ))
+
+        for thread in threads:
+            thread.start()
+
+        reports = []
+        pending = {}
+        next_seq = 0
+        while True:
+            entry = results.get()
+            if entry is _END:
+                break
+            seq, key, outcome = entry
+            pending[seq] = make_report(key, outcome)
+            while next_seq in pending:
+                report = pending.pop(next_seq)
+                next_seq += 1
+                in_flight.release()
+                reports.append(report)
+                if on_result:
+                    on_result(report)
+
+        for thread in threads:
+            thread.join()
+        if feed_error:
+            raise feed_error[0]
+        return reports
+
+    def _work(self, stage, in_queue, out_queue, results, finished):
+        """Worker loop: take items (or batches), run the stage, pass results on."""
+        try:
+            while True:
+                batch, ended = self._take(stage, in_queue)
+                if batch:
+                    self._process(stage, batch, out_queue, results)
+                if ended:
+                    return
+        finally:
+            finished()
+
+    @staticmethod
+    def _take(stage, in_queue):
+        """Block for one item, then gather up to batch_size without waiting long."""
+        first = in_queue.get()
+        if first is _END:
+            return [], True
+
+        batch = [first]
+        while len(batch) < stage.batch_size:
+            try:
+                entry = in_queue.get(timeout=stage.batch_wait)
+            except queue.Empty:
+                break
+            if entry is _END:
+                return batch, True
+            batch.append(entry)
+        return batch, False
+
+    @staticmethod
+    def _process(stage, batch, out_queue, results):
+        """Run one stage over a batch, routing failures straight to the results."""
+        if stage.batch_size > 1:
+            try:
+                outcomes = stage.func([key for _, key, _ in batch], [value for _, _, value in batch])
+            except Exception as e:
+                outcomes = [e] * len(batch)
+        else:
+            outcomes = []
+            for _, key, value in batch:
+                try:
+                    outcomes.append(stage.func(key, value))
+                except Exception as e:
+                    outcomes.append(e)
+
+        for (seq, key, _), outcome in zip(batch, outcomes):
+            if isinstance(outcome, Exception):
+                if not hasattr(outcome, 'stage'):
+                    outcome.stage = stage.name
+                results.put((seq, key, outcome))
+            else:
+                out_queue.put((seq, key, outcome))
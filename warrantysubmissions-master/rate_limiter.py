@@ -0,0 +1,193 @@
+import os
+import json
+import random
+import threading
+import time
+from googleapiclient.errors import HttpError
+from metrics import record_retry
+
+# Quota units charged per call; anything not listed costs one unit
+QUOTA_COSTS = {
+    'gmail': {
+        'messages.list': 5,
+        'messages.get': 5,
+        'history.list': 2,
+        'getProfile': 1,
+        'watch': 100
+    },
+    'drive': {
+        'files.create': 1,
+        'files.list': 1,
+        'files.delete': 1
+    },
+    'sheets': {
+        'values.append': 1
+    }
+}
+
+# Default per-user quotas, in units per second: Gmail allows 250 units/s,
+# Drive 12,000 queries/min and Sheets 60 write requests/min
+DEFAULT_RATES = {
+    'gmail': 250,
+    'drive': 200,
+    'sheets': 1
+}
+
+RATE_LIMIT_REASONS = {'rateLimitExceeded', 'userRateLimitExceeded'}
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+class AdaptiveRateLimiter:
+    """A token bucket whose rate adapts to the quota errors it sees.
+
+    Callers reserve the quota units a call costs before making it and sleep
+    until the bucket can cover them, so concurrent threads share one budget.
+    The rate follows AIMD: every successful call raises it by a small
+    step up to max_rate, and a rate-limit error halves it, at most once per
+    cooldown so a burst of errors from one overshoot counts only once.
+    """
+
+    def __init__(self, name, max_rate, burst=None, min_fraction=0.05, increase_fraction=0.01,
+                 decrease=0.5, cooldown=1.0):
+        self.name = name
+        self.max_rate = float(max_rate)
+        self.min_rate = self.max_rate * min_fraction
+        self.increase = self.max_rate * increase_fraction
+        self.decrease = decrease
+        self.cooldown = cooldown
+        self.capacity = float(burst or max_rate)
+        self.rate = self.max_rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._last_decrease = 0.0
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.throttled = 0
+        self.waited = 0.0
+
+    def acquire(self, cost=1):
+        """Reserve cost units, sleeping until the bucket can cover them."""
+        with self._lock:
+            self._refill()
+            # Reserve now and let the balance go negative, so large costs
+            # are never starved and callers are served in arrival order
+            self._tokens -= cost
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+            self.calls += 1
+            self.waited += wait
+        if wait:
+            time.sleep(wait)
+
+    def succeeded(self):
+        """Additive increase after a call went through."""
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def rate_limited(self):
+        """Multiplicative decrease after a rate-limit error."""
+        with self._lock:
+            self.throttled += 1
+            now = time.monotonic()
+            if now - self._last_decrease < self.cooldown:
+                return
+            self._last_decrease = now
+            self._refill()
+            self.rate = max(self.min_rate, self.rate * self.decrease)
+            # Drop the burst allowance so waiting callers slow down at once
+            self._tokens = min(self._tokens, 0.0)
+            print(f"Rate limited by {self.name}; slowing to {self.rate:.1f} units/s")
+
+    def stats(self):
+        """Return call, throttle and wait totals plus the current rate."""
+        with self._lock:
+            return {
+                'rate': self.rate,
+                'calls': self.calls,
+                'throttled': self.throttled,
+                'waited': self.waited
+            }
+
+    def _refill(self):
+        """Add the tokens earned since the last update; the caller holds the lock."""
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+def get_rate_limiter(api):
+    """Return the process-wide limiter for an API, sized from RATE_LIMIT_<API>."""
+    limiter = _limiters.get(api)
+    if limiter is None:
+        with _limiters_lock:
+            limiter = _limiters.get(api)
+            if limiter is None:
+                rate = float(os.getenv(f"RATE_LIMIT_{api.upper()}", str(DEFAULT_RATES.get(api, 10))))
+                limiter = AdaptiveRateLimiter(api, rate)
+                _limiters[api] = limiter
+    return limiter
+
+def get_limiter_stats():
+    """Return stats for every limiter used so far."""
+    with _limiters_lock:
+        limiters = dict(_limiters)
+    return {api: limiter.stats() for api, limiter in limiters.items()}
+
+def quota_cost(api, method):
+    """Return the quota units one call to api.method costs."""
+    return QUOTA_COSTS.get(api, {}).get(method, 1)
+
+def is_rate_limit_error(error):
+    """True for 429s and for 403s whose reason is a rate limit."""
+    if not isinstance(error, HttpError):
+        return False
+    if error.resp.status == 429:
+        return True
+    if error.resp.status != 403:
+        return False
+
+    try:
+        details = json.loads(error.content.decode('utf-8'))['error']
+    except (AttributeError, UnicodeDecodeError, ValueError, KeyError, TypeError):
+        return False
+    reasons = {detail.get('reason') for detail in details.get('errors', []) if isinstance(detail, dict)}
+    return bool(reasons & RATE_LIMIT_REASONS)
+
+def backoff_delay(attempt, base=None, cap=None):
+    """Return a full-jitter exponential backoff delay for a retry attempt."""
+    base = base if base is not None else float(os.getenv('RATE_LIMIT_BACKOFF_BASE', '1'))
+    cap = cap if cap is not None else float(os.getenv('RATE_LIMIT_BACKOFF_CAP', '64'))
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+def get_max_retries():
+    """Read how often a rate-limited call is retried."""
+    return int(os.getenv('RATE_LIMIT_MAX_RETRIES', '5'))
+
+def call_with_quota(api, method, func, cost=None, max_retries=None):
+    """Call func() within the API's quota, retrying rate-limit errors.
+
+    Any other error is raised straight away, as is a rate-limit error once
+    the retries are used up.
+    """
+    limiter = get_rate_limiter(api)
+    cost = cost if cost is not None else quota_cost(api, method)
+    max_retries = max_retries if max_retries is not None else get_max_retries()
+
+    for attempt in range(max_retries + 1):
+        limiter.acquire(cost)
+        try:
+            result = func()
+        except HttpError as e:
+            if not is_rate_limit_error(e) or attempt == max_retries:
+                raise
+            limiter.rate_limited()
+            record_retry(f"{api}.{method}")
+            delay = backoff_delay(attempt)
+            print(f"{api} {method} rate limited, retrying in {delay:.1f}s")
+            time.sleep(delay)
+            continue
+        limiter.succeeded()
+        return result
+
+def execute_with_quota(request, api, method, **kwargs):
+    """Execute a Google API request within the API's quota."""
+    return call_with_quota(api, method, request.execute, **kwargs)
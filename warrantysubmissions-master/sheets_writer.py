@@ -0,0 +1,160 @@
+import os
+import re
+import time
+import threading
+from datetime import datetime
+from rate_limiter import execute_with_quota
+from metrics import instrument, record_retry
+
+SHEET_RANGE = 'Sheet1!A:Z'  # Adjust based on your sheet's structure
+
+# Matches the A1 range Sheets reports back, e.g. Sheet1!A12:I14
+UPDATED_RANGE_PATTERN = re.compile(r"^(?P<sheet>.+)!(?P<start_col>[A-Z]+)(?P<start_row>\d+):(?P<end_col>[A-Z]+)(?P<end_row>\d+)$")
+
+def build_sheet_row(data):
+    """Build the sheet row for one warranty submission."""
+    return [
+        datetime.now().strftime('%Y-%m-%d %H:%M:%S'),  # Timestamp
+        data.get('customer_name', ''),
+        data.get('email', ''),
+        data.get('phone', ''),
+        data.get('address', ''),
+        data.get('product_model', ''),
+        data.get('serial_number', ''),
+        data.get('purchase_date', ''),
+        data.get('pdf_url', '')  # This will be the Drive link to the PDF
+    ]
+
+def split_updated_range(updated_range, count):
+    """Split the range of a multi-row append into one range per row."""
+    match = UPDATED_RANGE_PATTERN.match(updated_range or '')
+    if not match:
+        return [updated_range] * count
+
+    start_row = int(match.group('start_row'))
+    sheet = match.group('sheet')
+    start_col = match.group('start_col')
+    end_col = match.group('end_col')
+    return [
+        f"{sheet}!{start_col}{row}:{end_col}{row}"
+        for row in range(start_row, start_row + count)
+    ]
+
+def get_writer_settings():
+    """Read Sheets batching thresholds from the environment."""
+    return {
+        'max_rows': int(os.getenv('SHEETS_BATCH_ROWS', '500')),
+        'max_delay': float(os.getenv('SHEETS_FLUSH_SECONDS', '30')),
+        'max_retries': int(os.getenv('SHEETS_MAX_RETRIES', '3'))
+    }
+
+class SheetsBatchWriter:
+    """Collect sheet rows and append them with as few API calls as possible.
+
+    Rows are flushed in a single values.append once max_rows are buffered or
+    the oldest buffered row is max_delay seconds old, and again on close().
+    The age is only checked when a row is added, so rows in a quiet stream
+    wait for the next add() or for close(); every sync closes its writer.
+    A failed append leaves its rows buffered, so only rows that were never
+    written are sent again; after a failed threshold flush, add() waits
+    another max_delay before trying again and leaves the bounded retries
+    to close(). on_written(message_id, row_range) and on_failed(message_id,
+    error) report the outcome of every row.
+    """
+
+    def __init__(self, sheets_service, spreadsheet_id=None, on_written=None, on_failed=None,
+                 max_rows=500, max_delay=30, max_retries=3):
+        self.sheets_service = sheets_service
+        self.spreadsheet_id = spreadsheet_id or os.getenv('GOOGLE_SHEET_ID')
+        self.on_written = on_written
+        self.on_failed = on_failed
+        self.max_rows = max_rows
+        self.max_delay = max_delay
+        self.max_retries = max_retries
+        self._pending = []
+        self._oldest = None
+        self._retry_at = None
+        self._lock = threading.RLock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def add(self, message_id, data):
+        """Buffer one submission, flushing if a threshold is reached."""
+        with self._lock:
+            if not self._pending:
+                self._oldest = time.monotonic()
+            self._pending.append((message_id, build_sheet_row(data)))
+        self.flush_if_due()
+
+    def flush_if_due(self):
+        """Flush when the size or age threshold has been reached."""
+        with self._lock:
+            now = time.monotonic()
+            if self._retry_at is not None and now < self._retry_at:
+                return
+            due = self._pending and (
+                len(self._pending) >= self.max_rows
+                or now - self._oldest >= self.max_delay
+            )
+            if due:
+                # Back off during an outage instead of retrying on every add()
+                self._retry_at = None if self.flush() else time.monotonic() + self.max_delay
+
+    def flush(self, retries=0):
+        """Append all buffered rows in one call; return True if nothing is left."""
+        with self._lock:
+            for attempt in range(retries + 1):
+                if not self._pending:
+                    return True
+                try:
+                    self._append_pending()
+                    return True
+                except Exception as e:
+                    print(f"Error appending {len(self._pending)} rows to Google Sheets: {e}")
+                    if attempt < retries:
+                        record_retry('append_to_sheets')
+                        time.sleep(2 ** attempt)
+            return False
+
+    def close(self):
+        """Flush remaining rows at shutdown, reporting any that never made it."""
+        if self.flush(retries=self.max_retries):
+            return
+
+        with self._lock:
+            failed, self._pending = self._pending, []
+        for message_id, _ in failed:
+            if self.on_failed:
+                self.on_failed(message_id, 'Could not append to Google Sheets')
+
+    @instrument('append_to_sheets')
+    def _append_pending(self):
+        """Send the buffered rows and return how many; the caller holds the lock."""
+        batch = list(self._pending)
+        result = execute_with_quota(
+            self.sheets_service.spreadsheets().values().append(
+                spreadsheetId=self.spreadsheet_id,
+                range=SHEET_RANGE,
+                valueInputOption='RAW',
+                insertDataOption='INSERT_ROWS',
+                body={'values': [row for _, row in batch]}
+            ),
+            'sheets',
+            'values.append'
+        )
+
+        # The rows are written; drop them before reporting so a failing
+        # callback can never cause them to be sent twice
+        del self._pending[:len(batch)]
+        self._oldest = time.monotonic() if self._pending else None
+
+        updated_range = result.get('updates', {}).get('updatedRange')
+        print(f"Appended {len(batch)} rows to Google Sheets: {updated_range}")
+        if self.on_written:
+            for (message_id, _), row_range in zip(batch, split_updated_range(updated_range, len(batch))):
+                self.on_written(message_id, row_range)
+        return len(batch)
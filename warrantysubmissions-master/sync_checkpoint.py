@@ -0,0 +1,44 @@
+import os
+import json
+import time
+
+def get_checkpoint_path():
+    """Return where the Gmail sync checkpoint is stored."""
+    return os.getenv('SYNC_CHECKPOINT_PATH', 'sync_checkpoint.json')
+
+def load_checkpoint(path=None):
+    """Load the last synced Gmail historyId, or None if there is no checkpoint."""
+    path = path or get_checkpoint_path()
+    if not os.path.exists(path):
+        return None
+
+    try:
+        with open(path, 'r') as f:
+            checkpoint = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Ignoring unreadable sync checkpoint {path}: {e}")
+        return None
+
+    if not checkpoint.get('history_id'):
+        return None
+    return checkpoint
+
+def save_checkpoint(history_id, listed_at=None, path=None):
+    """Persist the Gmail historyId that the next run should continue from.
+
+    listed_at is when the listing that reached history_id started; the next
+    run searches for mail from then on, however long processing took.
+    """
+    path = path or get_checkpoint_path()
+    now = int(time.time())
+    checkpoint = {
+        'history_id': str(history_id),
+        'listed_at': int(listed_at) if listed_at else now,
+        'synced_at': now
+    }
+
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'w') as f:
+        json.dump(checkpoint, f)
+    os.replace(temp_path, path)
+    return checkpoint
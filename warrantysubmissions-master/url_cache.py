@@ -0,0 +1,111 @@
+import os
+import sqlite3
+import threading
+import time
+
+_url_cache = None
+_url_cache_lock = threading.Lock()
+
+class UrlCache:
+    """SQLite cache of downloaded PDF URLs and their HTTP validators.
+
+    Each CDN URL maps to the ETag and Last-Modified the CDN sent with it and
+    to the local copy in the PDF store, so a repeat download can be a
+    conditional GET answered by a 304 instead of the whole file. Entries
+    expire ttl seconds after they were last validated, and only the
+    max_entries most recently used are kept.
+    """
+
+    def __init__(self, path, max_entries=10000, ttl=30 * 24 * 60 * 60):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS pdf_urls (
+                    url TEXT PRIMARY KEY,
+                    etag TEXT,
+                    last_modified TEXT,
+                    size INTEGER NOT NULL,
+                    sha256 TEXT NOT NULL,
+                    local_path TEXT NOT NULL,
+                    validated_at REAL NOT NULL,
+                    used_at REAL NOT NULL
+                )
+            ''')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS pdf_urls_used_at ON pdf_urls (used_at)')
+
+    def get(self, url):
+        """Return the cached entry for a URL if it is fresh and its file still exists."""
+        with self._lock:
+            row = self._conn.execute('SELECT * FROM pdf_urls WHERE url = ?', (url,)).fetchone()
+        if row is None:
+            return None
+
+        entry = dict(row)
+        if entry['validated_at'] < time.time() - self.ttl or not os.path.exists(entry['local_path']):
+            self.forget(url)
+            return None
+        return entry
+
+    def record(self, url, local_path, sha256, size, etag=None, last_modified=None):
+        """Remember a fresh download, evicting the least recently used entries."""
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO pdf_urls VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (url, etag, last_modified, size, sha256, local_path, now, now)
+            )
+            self._conn.execute(
+                '''DELETE FROM pdf_urls WHERE url IN (
+                       SELECT url FROM pdf_urls ORDER BY used_at DESC LIMIT -1 OFFSET ?
+                   )''',
+                (self.max_entries,)
+            )
+
+    def revalidated(self, url):
+        """Mark an entry as confirmed unchanged by a 304."""
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                'UPDATE pdf_urls SET validated_at = ?, used_at = ? WHERE url = ?',
+                (now, now, url)
+            )
+
+    def forget(self, url):
+        """Drop one entry."""
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM pdf_urls WHERE url = ?', (url,))
+
+    def close(self):
+        """Close the underlying database connection."""
+        with self._lock:
+            self._conn.close()
+
+def conditional_headers(entry):
+    """Return If-None-Match / If-Modified-Since headers for a cached entry."""
+    headers = {}
+    if entry.get('etag'):
+        headers['If-None-Match'] = entry['etag']
+    if entry.get('last_modified'):
+        headers['If-Modified-Since'] = entry['last_modified']
+    return headers
+
+def get_url_cache():
+    """Return the process-wide URL cache, or None when URL_CACHE_ENABLED is off."""
+    global _url_cache
+    if os.getenv('URL_CACHE_ENABLED', 'true').lower() != 'true':
+        return None
+    if _url_cache is None:
+        with _url_cache_lock:
+            if _url_cache is None:
+                _url_cache = UrlCache(
+                    os.getenv('URL_CACHE_PATH', 'url_cache.db'),
+                    max_entries=int(os.getenv('URL_CACHE_MAX_ENTRIES', '10000')),
+                    ttl=float(os.getenv('URL_CACHE_TTL_DAYS', '30')) * 24 * 60 * 60
+                )
+    return _url_cache